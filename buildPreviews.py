@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Preview Builder
+Pre-builds a mip pyramid (1/2, 1/4, 1/8 and a 120px thumbnail) for every
+layer image so editors and viewers can show previews without decoding and
+resizing the full-resolution PNGs each time.
+
+Previews live in a cache directory that mirrors the tree:
+    .cache/previews/<game>/<character>/pose<N>/<folder>/<name>@2.png
+                                                         <name>@4.png
+                                                         <name>@8.png
+                                                         <name>@thumb.png
+    .cache/previews/manifest.json    source size/mtime and level sizes
+
+Layers small enough that a pyramid level already fits the thumbnail get no
+@thumb file. A layer is rebuilt only when its source image changed since the
+last build.
+Readers call find_preview() to get the smallest level that still covers the
+size they want to display.
+
+Usage:
+    python buildPreviews.py [directory] [--force] [--clean]
+"""
+
+import os
+import sys
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from spriteTree import iter_all_layers, load_json, write_json
+
+CACHE_DIR = Path(".cache") / "previews"
+MANIFEST_FILENAME = "manifest.json"
+# Downscale factors of the pyramid, each level built from the previous one
+MIP_FACTORS = [2, 4, 8]
+THUMBNAIL_SIZE = (120, 120)
+
+_manifest_cache = {}
+
+
+def cache_root(root=".") -> Path:
+    return Path(root) / CACHE_DIR
+
+
+def level_path(image_path, level: str, root=".") -> Path:
+    """
+    Path of one pyramid level of an image.
+
+    Args:
+        image_path: Path to the source image, relative to root or absolute
+        level (str): "2", "4", "8" or "thumb"
+        root: Root of the data tree
+
+    Returns:
+        Path: Path of the preview image in the cache
+    """
+    relative = Path(os.path.relpath(os.path.abspath(image_path), os.path.abspath(root)))
+    return cache_root(root) / relative.parent / f"{relative.stem}@{level}.png"
+
+
+def source_signature(image_path) -> Tuple[int, int]:
+    """(size, mtime_ns) of a source file, used to detect stale previews."""
+    stat = os.stat(image_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_layer(image_path: str, root: str = ".") -> Dict:
+    """
+    Build all pyramid levels of one image.
+
+    Args:
+        image_path (str): Path to the source image
+        root (str): Root of the data tree
+
+    Returns:
+        Dict: Manifest entry with the source signature and level sizes
+    """
+    size, mtime_ns = source_signature(image_path)
+    levels = {}
+
+    with Image.open(image_path) as img:
+        current = img.convert("RGBA")
+    levels["1"] = list(current.size)
+    images = [current]
+
+    for factor in MIP_FACTORS:
+        # Halve the previous level instead of reducing the original again
+        current = current.reduce(2) if min(current.size) >= 2 else current
+        target = level_path(image_path, str(factor), root)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        current.save(target, "PNG", compress_level=1)
+        levels[str(factor)] = list(current.size)
+        images.append(current)
+
+    # Scale down from the smallest level that still covers the thumbnail; if
+    # that level already fits, the thumbnail would only duplicate it
+    scale = min(THUMBNAIL_SIZE[0] / images[0].width, THUMBNAIL_SIZE[1] / images[0].height, 1.0)
+    source = next(image for image in reversed(images)
+                  if image.width >= images[0].width * scale - 0.5 and image.height >= images[0].height * scale - 0.5)
+    thumb_path = level_path(image_path, "thumb", root)
+    if source.width > THUMBNAIL_SIZE[0] or source.height > THUMBNAIL_SIZE[1]:
+        thumb = source.copy()
+        thumb.thumbnail(THUMBNAIL_SIZE)
+        thumb.save(thumb_path, "PNG", compress_level=1)
+        levels["thumb"] = list(thumb.size)
+    elif thumb_path.exists():
+        thumb_path.unlink()
+
+    return {"size": size, "mtime_ns": mtime_ns, "levels": levels}
+
+
+def _build_job(args: Tuple[str, str, str]) -> Tuple[str, Optional[Dict], str]:
+    key, image_path, root = args
+    try:
+        return key, build_layer(image_path, root), ""
+    except Exception as e:
+        return key, None, str(e)
+
+
+def load_manifest(root=".") -> Dict:
+    """
+    Load the preview manifest, reusing the parsed copy while it is unchanged.
+
+    Args:
+        root: Root of the data tree
+
+    Returns:
+        Dict: Manifest entries keyed by source path relative to root
+    """
+    path = cache_root(root) / MANIFEST_FILENAME
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    cached = _manifest_cache.get(path)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, load_json(path))
+        _manifest_cache[path] = cached
+    return cached[1]
+
+
+def is_fresh(entry: Optional[Dict], image_path) -> bool:
+    """Whether a manifest entry still matches its source image."""
+    if not entry:
+        return False
+    try:
+        return tuple(source_signature(image_path)) == (entry["size"], entry["mtime_ns"])
+    except FileNotFoundError:
+        return False
+
+
+def find_preview(image_path, display_size: Tuple[int, int], root=".") -> Path:
+    """
+    Pick the smallest fresh preview that covers a display size.
+
+    The image is assumed to be shown fitted into display_size while keeping
+    its aspect ratio (like PIL's thumbnail()). Falls back to the source image
+    when no fresh preview is large enough.
+
+    Args:
+        image_path: Path to the source image
+        display_size (Tuple[int, int]): Box the image will be displayed in
+        root: Root of the data tree
+
+    Returns:
+        Path: Path of the image to load
+    """
+    relative = os.path.relpath(os.path.abspath(image_path), os.path.abspath(root))
+    entry = load_manifest(root).get(Path(relative).as_posix())
+    if not is_fresh(entry, image_path):
+        return Path(image_path)
+
+    full_w, full_h = entry["levels"]["1"]
+    scale = min(display_size[0] / full_w, display_size[1] / full_h, 1.0)
+    needed = (full_w * scale, full_h * scale)
+
+    candidates = sorted(((w * h, level) for level, (w, h) in entry["levels"].items()
+                         if level != "1" and w >= needed[0] - 0.5 and h >= needed[1] - 0.5))
+    for _, level in candidates:
+        path = level_path(image_path, level, root)
+        if path.exists():
+            return path
+    return Path(image_path)
+
+
+def build_previews(directory: str = ".", force: bool = False) -> Tuple[int, int, List[Tuple[str, str]]]:
+    """
+    Build the preview pyramid of every layer under directory in parallel.
+
+    Args:
+        directory (str): Root of the data tree
+        force (bool): Rebuild even up-to-date layers
+
+    Returns:
+        Tuple[int, int, List[Tuple[str, str]]]: (built, up to date, errors)
+    """
+    manifest = dict(load_manifest(directory))
+    jobs = []
+    seen = set()
+    up_to_date = 0
+
+    for layer in iter_all_layers(directory):
+        if layer.image_path is None:
+            continue
+        key = Path(os.path.relpath(layer.image_path, directory)).as_posix()
+        seen.add(key)
+        if not force and is_fresh(manifest.get(key), layer.image_path):
+            up_to_date += 1
+            continue
+        jobs.append((key, str(layer.image_path), directory))
+
+    errors = []
+    if jobs:
+        with ProcessPoolExecutor() as executor:
+            for key, entry, error in executor.map(_build_job, jobs, chunksize=8):
+                if entry is None:
+                    errors.append((key, error))
+                    manifest.pop(key, None)
+                else:
+                    manifest[key] = entry
+
+    # Forget layers that no longer exist
+    for key in set(manifest) - seen:
+        del manifest[key]
+
+    save_manifest(manifest, directory)
+    return len(jobs) - len(errors), up_to_date, errors
+
+
+def save_manifest(manifest: Dict, root=".") -> None:
+    cache_root(root).mkdir(parents=True, exist_ok=True)
+    write_json(cache_root(root) / MANIFEST_FILENAME, manifest)
+
+
+def update_previews(image_paths: List[str], root: str = ".") -> List[Tuple[str, str]]:
+    """
+    Rebuild the previews of a few images in this process, e.g. after an edit.
+
+    Images that no longer exist are dropped from the manifest.
+
+    Args:
+        image_paths (List[str]): Paths to the changed source images
+        root (str): Root of the data tree
+
+    Returns:
+        List[Tuple[str, str]]: (path, error) for images that failed
+    """
+    manifest = dict(load_manifest(root))
+    errors = []
+    for image_path in image_paths:
+        key = Path(os.path.relpath(os.path.abspath(image_path), os.path.abspath(root))).as_posix()
+        if not os.path.exists(image_path):
+            manifest.pop(key, None)
+            continue
+        try:
+            manifest[key] = build_layer(image_path, root)
+        except Exception as e:
+            manifest.pop(key, None)
+            errors.append((image_path, str(e)))
+    save_manifest(manifest, root)
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build preview mip pyramids for every layer.")
+    parser.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+    parser.add_argument("--force", action="store_true", help="Rebuild all previews")
+    parser.add_argument("--clean", action="store_true", help="Delete the preview cache and exit")
+    args = parser.parse_args()
+
+    if args.clean:
+        shutil.rmtree(cache_root(args.directory), ignore_errors=True)
+        print(f"Removed {cache_root(args.directory)}")
+        return
+
+    built, up_to_date, errors = build_previews(args.directory, force=args.force)
+
+    print(f"Built previews for {built} layer(s), {up_to_date} already up to date.")
+    if errors:
+        print("\nFailed layers:")
+        for key, error in errors:
+            print(f"  - {key}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
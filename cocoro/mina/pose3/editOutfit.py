@@ -1,9 +1,31 @@
 import os
+import sys
 import json
+import tempfile
 import tkinter as tk
 from tkinter import messagebox, ttk
 from PIL import Image, ImageTk
 
+
+def find_tree_root(directory):
+    """
+    Find the root of the data tree (the folder holding gamelist.json).
+
+    Args:
+        directory (str): Directory inside the tree
+
+    Returns:
+        str: Path of the tree root, or None if there is none
+    """
+    current = os.path.abspath(directory)
+    while not os.path.exists(os.path.join(current, "gamelist.json")):
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+    return current
+
+
 class outfitEditor:
     def __init__(self, root, directory):
         self.root = root
@@ -16,6 +38,20 @@ class outfitEditor:
         self.current_image_path = None
         self.thumbnails = {}  # Cache for thumbnails
         self.sidebar_buttons = []  # Store sidebar button references
+        self.sidebar_frames = []  # Frames behind the buttons, used to highlight the selection
+        self.selected = set()  # Indices selected for bulk edits
+        self.anchor = 0  # Start of a Shift+click range
+
+        # Use the preview pyramid of buildPreviews.py when it is available
+        self.tree_root = find_tree_root(directory)
+        self.find_preview = None
+        if self.tree_root:
+            sys.path.insert(0, self.tree_root)
+            try:
+                from buildPreviews import find_preview
+                self.find_preview = find_preview
+            except ImportError:
+                pass
 
         if not self.files:
             messagebox.showerror("Error", "No JSON files found in this directory.")
@@ -80,11 +116,37 @@ class outfitEditor:
         self.save_button = tk.Button(button_frame, text="Save", command=self.save_current)
         self.save_button.pack(side=tk.LEFT, padx=5)
 
+        self.apply_button = tk.Button(button_frame, text="Apply to Selected", command=self.apply_to_selected)
+        self.apply_button.pack(side=tk.LEFT, padx=5)
+
+        # Selection status (Ctrl+click toggles, Shift+click selects a range)
+        self.selection_label = tk.Label(content_frame, text="")
+        self.selection_label.pack()
+
         # Bind mouse wheel to canvas for scrolling
         def _on_mousewheel(event):
             canvas.yview_scroll(int(-1*(event.delta/120)), "units")
         canvas.bind("<MouseWheel>", _on_mousewheel)
 
+    def preview_path(self, image_path, size):
+        """
+        Path of the smallest cached preview covering size, or the image itself.
+
+        Args:
+            image_path (str): Path to the source image
+            size (tuple): Box the image will be shown in
+
+        Returns:
+            str: Path of the image to load
+        """
+        if self.find_preview is None:
+            return image_path
+        try:
+            return str(self.find_preview(image_path, size, self.tree_root))
+        except Exception as e:
+            print(f"Error looking up preview for {image_path}: {e}")
+            return image_path
+
     def load_thumbnails(self):
         """Load and create thumbnail buttons for all files"""
         for i, json_filename in enumerate(self.files):
@@ -100,7 +162,7 @@ class outfitEditor:
             # Create thumbnail
             if image_path:
                 try:
-                    img = Image.open(image_path)
+                    img = Image.open(self.preview_path(image_path, (120, 120)))
                     img.thumbnail((120, 120))  # Small thumbnail for sidebar
                     thumbnail = ImageTk.PhotoImage(img)
                     self.thumbnails[i] = thumbnail
@@ -136,6 +198,10 @@ class outfitEditor:
 
             thumb_button.pack()
 
+            # Modifier clicks edit the selection instead of navigating
+            thumb_button.bind("<Control-Button-1>", lambda e, idx=i: self.toggle_selection(idx))
+            thumb_button.bind("<Shift-Button-1>", lambda e, idx=i: self.select_range(idx))
+
             # Add filename label
             filename_label = tk.Label(
                 button_frame,
@@ -146,6 +212,7 @@ class outfitEditor:
             filename_label.pack()
 
             self.sidebar_buttons.append(thumb_button)
+            self.sidebar_frames.append(button_frame)
 
     def update_sidebar_selection(self):
         """Update the visual selection in the sidebar"""
@@ -154,12 +221,42 @@ class outfitEditor:
                 button.config(relief=tk.SUNKEN, borderwidth=3)
             else:
                 button.config(relief=tk.RAISED, borderwidth=2)
+            self.sidebar_frames[i].config(bg='steelblue' if i in self.selected else 'lightgray')
+
+        targets = self.selected_indices()
+        if len(targets) > 1:
+            self.selection_label.config(text=f"{len(targets)} files selected")
+        else:
+            self.selection_label.config(text="")
+
+    def selected_indices(self):
+        """Files a bulk edit applies to: the selection plus the current file"""
+        return sorted(self.selected | {self.index})
+
+    def toggle_selection(self, index):
+        """Ctrl+click: add or remove a file from the selection"""
+        if index in self.selected:
+            self.selected.discard(index)
+        else:
+            self.selected.add(index)
+        self.anchor = index
+        self.update_sidebar_selection()
+        return "break"  # Don't run the button command
+
+    def select_range(self, index):
+        """Shift+click: select every file between the anchor and this one"""
+        low, high = sorted((self.anchor, index))
+        self.selected.update(range(low, high + 1))
+        self.update_sidebar_selection()
+        return "break"  # Don't run the button command
 
     def jump_to_file(self, index):
         """Jump to a specific file by index"""
         if 0 <= index < len(self.files):
             self.save_current()  # Save current changes before jumping
             self.index = index
+            self.selected.clear()
+            self.anchor = index
             self.load_file()
 
     def load_file(self):
@@ -192,7 +289,7 @@ class outfitEditor:
 
         # Show image if found
         if self.current_image_path:
-            img = Image.open(self.current_image_path)
+            img = Image.open(self.preview_path(self.current_image_path, (600, 600)))
             img.thumbnail((600, 600))  # resize to fit
             self.tk_img = ImageTk.PhotoImage(img)
             self.image_label.config(image=self.tk_img, text="")
@@ -211,13 +308,55 @@ class outfitEditor:
     def save_current(self):
         """Save current file without navigating"""
         if self.current_json_path:
-            with open(self.current_json_path, "r", encoding="utf-8-sig") as f:
-                data = json.load(f)
-
-            data["outfit"] = self.entry.get()
+            self.write_outfits([self.current_json_path], self.entry.get())
+
+    def write_outfits(self, json_paths, outfit):
+        """
+        Set the outfit of several files in one transaction.
+
+        Every file is read and written to a temporary file first; only when
+        all of them succeeded are the temporary files moved over the
+        originals. Files that already have this outfit are not rewritten.
+
+        Returns the number of files changed.
+        """
+        staged = []
+        try:
+            for json_path in json_paths:
+                with open(json_path, "r", encoding="utf-8-sig") as f:
+                    data = json.load(f)
+
+                if data.get("outfit") == outfit:
+                    continue
+                data["outfit"] = outfit
+
+                fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=os.path.dirname(json_path))
+                staged.append((tmp_path, json_path))
+                with os.fdopen(fd, "w", encoding="utf-8-sig") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+        except Exception:
+            for tmp_path, _ in staged:
+                os.remove(tmp_path)
+            raise
+
+        for tmp_path, json_path in staged:
+            os.replace(tmp_path, json_path)
+        return len(staged)
+
+    def apply_to_selected(self):
+        """Save the entered outfit to every selected file at once"""
+        targets = self.selected_indices()
+        json_paths = [os.path.join(self.directory, self.files[i]) for i in targets]
+
+        try:
+            changed = self.write_outfits(json_paths, self.entry.get())
+        except Exception as e:
+            messagebox.showerror("Error", f"Nothing was saved: {e}")
+            return
 
-            with open(self.current_json_path, "w", encoding="utf-8-sig") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+        self.selected.clear()
+        self.load_file()
+        self.selection_label.config(text=f"Updated {changed} of {len(targets)} files")
 
     def save_and_next(self):
         """Save current file and move to next"""
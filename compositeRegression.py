@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Composite Regression
+Checks that batch operations (unpremultiply, trimming, re-optimizing PNGs,
+offset edits) did not change what the sprites look like.
+
+For every body layer one reference composite is rendered: the body with
+the first face and the first blush that fit its outfit variant. "record"
+stores a hash of each composite, a hash of every BLOCK_SIZE block of the
+canvas it covers and a 1/4 scale thumbnail for browsing; "check" renders
+them again and, for every composite whose hash changed, writes a heatmap of
+the blocks that changed.
+
+With "record --full-renders" the full-resolution render is stored as well,
+and "check" then compares changed composites with it pixel by pixel
+(max/mean error, changed pixels, per-pixel heatmap). Without it, --tolerance
+cannot be measured and every changed composite fails.
+
+Composites are blended with numpy, and only where layers overlap: the body
+is copied as is and each face or blush is blended over its own rectangle.
+Composites are rendered in parallel across a process pool.
+
+Store layout (default .cache/regression):
+    references.json                     hash, box and layers per composite
+    renders/<game>/<character>/pose<N>/<body>.png   full-resolution renders (--full-renders)
+    thumbs/<game>/<character>/pose<N>/<body>.png
+    diffs/<game>/<character>/pose<N>/<body>.png     heatmaps of the last check
+
+Usage:
+    python compositeRegression.py record [directory] [--store DIR] [--full-renders]
+    python compositeRegression.py check [directory] [--store DIR] [--tolerance N]
+"""
+
+import os
+import sys
+import shutil
+import struct
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from spriteTree import (CANVAS_FILENAME, Layer, find_pose_dirs, iter_layers, load_json,
+                        split_expression, split_outfit, write_json)
+
+DEFAULT_STORE = Path(".cache") / "regression"
+REFERENCES_FILENAME = "references.json"
+THUMB_FACTOR = 4
+BLOCK_SIZE = 128        # canvas-aligned blocks hashed to locate changes
+HEATMAP_GAIN = 4        # an error of 64 shows as full red
+
+
+def plan_composites(directory: str = ".") -> List[Tuple[str, List[Layer], Tuple[int, int]]]:
+    """
+    List the reference composites of every pose under directory.
+
+    Args:
+        directory (str): Root of the data tree
+
+    Returns:
+        List[Tuple[str, List[Layer], Tuple[int, int]]]:
+            (key, layers bottom to top, canvas size) per body layer
+    """
+    plan = []
+    for pose_dir in find_pose_dirs(directory):
+        canvas = load_json(pose_dir / CANVAS_FILENAME)
+        canvas_size = (canvas["ImageWidth"], canvas["ImageHeight"])
+        layers = [layer for layer in iter_layers(pose_dir, ["body", "faces", "blush"]) if layer.image_path]
+        for body in (layer for layer in layers if layer.kind == "body"):
+            _, variant = split_outfit(body.data.get("outfit", ""))
+            stack = [body]
+            for kind in ("faces", "blush"):
+                fitting = [layer for layer in layers if layer.kind == kind
+                           and split_expression(layer.data.get("expression", ""))[1] in (None, variant)]
+                stack.extend(fitting[:1])
+            key = Path(os.path.relpath(body.json_path.with_suffix(""), directory)).as_posix()
+            plan.append((key, stack, canvas_size))
+    return plan
+
+
+def render_composite(layers: List[Layer], canvas_size: Tuple[int, int]) -> Tuple[Tuple[int, int, int, int], np.ndarray]:
+    """
+    Blend layers bottom to top over the union of their rectangles.
+
+    The box is clipped to the canvas and widened to a multiple of
+    THUMB_FACTOR, so the thumbnail covers the render exactly.
+
+    Args:
+        layers (List[Layer]): Layers, bottom first
+        canvas_size (Tuple[int, int]): Canvas width and height
+
+    Returns:
+        Tuple[Tuple[int, int, int, int], np.ndarray]:
+            (left, top, right, bottom) and the straight-alpha RGBA pixels
+    """
+    images = []
+    for layer in layers:
+        with Image.open(layer.image_path) as img:
+            images.append((np.asarray(img.convert("RGBA")), layer.data["OffsetX"], layer.data["OffsetY"]))
+
+    left = max(0, min(x for _, x, _ in images))
+    top = max(0, min(y for _, _, y in images))
+    right = min(canvas_size[0], max(x + pixels.shape[1] for pixels, x, _ in images))
+    bottom = min(canvas_size[1], max(y + pixels.shape[0] for pixels, _, y in images))
+    left, top = left - left % THUMB_FACTOR, top - top % THUMB_FACTOR
+    right, bottom = right + -right % THUMB_FACTOR, bottom + -bottom % THUMB_FACTOR
+
+    out = np.zeros((bottom - top, right - left, 4), dtype=np.uint8)
+    for number, (pixels, x, y) in enumerate(images):
+        src_x0, src_y0 = max(0, left - x), max(0, top - y)
+        dst_x0, dst_y0 = max(0, x - left), max(0, y - top)
+        w = min(pixels.shape[1] - src_x0, out.shape[1] - dst_x0)
+        h = min(pixels.shape[0] - src_y0, out.shape[0] - dst_y0)
+        if w <= 0 or h <= 0:
+            continue
+        src = pixels[src_y0:src_y0 + h, src_x0:src_x0 + w]
+        dst = out[dst_y0:dst_y0 + h, dst_x0:dst_x0 + w]
+        if number == 0:
+            # Nothing underneath yet: the bottom layer is copied as is
+            dst[...] = src
+            continue
+
+        # Blend in float, premultiplied, over this layer's rectangle only
+        src = src.astype(np.float32) / 255
+        below = dst.astype(np.float32) / 255
+        src_alpha, below_alpha = src[..., 3:], below[..., 3:]
+        alpha = src_alpha + below_alpha * (1 - src_alpha)
+        color = src[..., :3] * src_alpha + below[..., :3] * below_alpha * (1 - src_alpha)
+        color = np.divide(color, alpha, out=np.zeros_like(color), where=alpha > 0)
+        dst[..., :3] = np.clip(np.rint(color * 255), 0, 255)
+        dst[..., 3:] = np.clip(np.rint(alpha * 255), 0, 255)
+
+    return (left, top, right, bottom), out
+
+
+def composite_hash(box: Tuple[int, int, int, int], pixels: np.ndarray) -> str:
+    """Hash of a rendered composite, including where it sits on the canvas."""
+    return hashlib.sha1(struct.pack("<4i", *box) + pixels.tobytes()).hexdigest()
+
+
+def block_hashes(box: Tuple[int, int, int, int], pixels: np.ndarray) -> Dict[str, str]:
+    """
+    Hash every canvas-aligned BLOCK_SIZE block a composite covers.
+
+    Blocks are padded with transparent pixels outside the box, so hashes of
+    two renders compare even when their boxes differ; empty blocks are left out.
+
+    Args:
+        box (Tuple[int, int, int, int]): Canvas box of the composite
+        pixels (np.ndarray): Rendered pixels
+
+    Returns:
+        Dict[str, str]: {"<column>,<row>": hash} of the non-empty blocks
+    """
+    left, top, right, bottom = box
+    hashes = {}
+    for row in range(top // BLOCK_SIZE, -(-bottom // BLOCK_SIZE)):
+        for column in range(left // BLOCK_SIZE, -(-right // BLOCK_SIZE)):
+            x0, y0 = column * BLOCK_SIZE, row * BLOCK_SIZE
+            block = np.zeros((BLOCK_SIZE, BLOCK_SIZE, 4), dtype=np.uint8)
+            cx0, cy0 = max(x0, left), max(y0, top)
+            cx1, cy1 = min(x0 + BLOCK_SIZE, right), min(y0 + BLOCK_SIZE, bottom)
+            block[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = pixels[cy0 - top:cy1 - top, cx0 - left:cx1 - left]
+            if block.any():
+                hashes[f"{column},{row}"] = hashlib.sha1(block.tobytes()).hexdigest()[:16]
+    return hashes
+
+
+def thumbnail(pixels: np.ndarray) -> np.ndarray:
+    """THUMB_FACTOR times smaller RGBA pixels (box filter)."""
+    return np.asarray(Image.fromarray(pixels, "RGBA").reduce(THUMB_FACTOR))
+
+
+def compare_renders(reference: np.ndarray, reference_box, current: np.ndarray,
+                    current_box) -> Tuple[int, float, int, np.ndarray]:
+    """
+    Per-pixel difference of two renders placed by their canvas boxes.
+
+    Args:
+        reference (np.ndarray): Stored reference render
+        reference_box: Canvas box of the reference composite
+        current (np.ndarray): New render
+        current_box: Canvas box of the new composite
+
+    Returns:
+        Tuple[int, float, int, np.ndarray]: (max error, mean error over the
+            covered area, number of changed pixels, RGB heatmap)
+    """
+    left = min(reference_box[0], current_box[0])
+    top = min(reference_box[1], current_box[1])
+    right = max(reference_box[2], current_box[2])
+    bottom = max(reference_box[3], current_box[3])
+
+    frames = []
+    for pixels, box in ((reference, reference_box), (current, current_box)):
+        frame = np.zeros((bottom - top, right - left, 4), dtype=np.int16)
+        x, y = box[0] - left, box[1] - top
+        frame[y:y + pixels.shape[0], x:x + pixels.shape[1]] = pixels
+        frames.append(frame)
+
+    error = np.abs(frames[0] - frames[1]).max(axis=2)
+    covered = (frames[0][..., 3] > 0) | (frames[1][..., 3] > 0)
+    mean_error = float(error[covered].mean()) if covered.any() else 0.0
+    changed = int((error > 0).sum())
+
+    # Dimmed grey of the new render with the error drawn in red on top
+    grey = (frames[1][..., :3].mean(axis=2) * frames[1][..., 3] / 255 / 3).astype(np.int16)
+    heatmap = np.repeat(grey[..., None], 3, axis=2)
+    heatmap[..., 0] = np.maximum(heatmap[..., 0], np.minimum(255, error * HEATMAP_GAIN))
+    return int(error.max()), mean_error, changed, heatmap.astype(np.uint8)
+
+
+def block_heatmap(current: np.ndarray, current_box, blocks: List[str]) -> np.ndarray:
+    """
+    Dimmed grey of a render with the changed blocks tinted red.
+
+    Args:
+        current (np.ndarray): New render
+        current_box: Canvas box of the new composite
+        blocks (List[str]): "<column>,<row>" of the changed blocks
+
+    Returns:
+        np.ndarray: RGB heatmap covering the render and the changed blocks
+    """
+    cells = [tuple(int(n) for n in block.split(",")) for block in blocks]
+    left = min([current_box[0]] + [column * BLOCK_SIZE for column, _ in cells])
+    top = min([current_box[1]] + [row * BLOCK_SIZE for _, row in cells])
+    right = max([current_box[2]] + [(column + 1) * BLOCK_SIZE for column, _ in cells])
+    bottom = max([current_box[3]] + [(row + 1) * BLOCK_SIZE for _, row in cells])
+
+    frame = np.zeros((bottom - top, right - left, 4), dtype=np.int16)
+    x, y = current_box[0] - left, current_box[1] - top
+    frame[y:y + current.shape[0], x:x + current.shape[1]] = current
+    grey = (frame[..., :3].mean(axis=2) * frame[..., 3] / 255 / 3).astype(np.int16)
+    heatmap = np.repeat(grey[..., None], 3, axis=2)
+    for column, row in cells:
+        x, y = column * BLOCK_SIZE - left, row * BLOCK_SIZE - top
+        red = heatmap[y:y + BLOCK_SIZE, x:x + BLOCK_SIZE, 0]
+        red[...] = np.maximum(red, 192)
+    return heatmap.astype(np.uint8)
+
+
+def _record_job(args: Tuple[str, List[Layer], Tuple[int, int], str, bool]) -> Tuple[str, Optional[Dict], str]:
+    key, layers, canvas_size, store, full_renders = args
+    try:
+        box, pixels = render_composite(layers, canvas_size)
+        thumb_path = Path(store) / "thumbs" / f"{key}.png"
+        thumb_path.parent.mkdir(parents=True, exist_ok=True)
+        Image.fromarray(thumbnail(pixels), "RGBA").save(thumb_path, "PNG", compress_level=1)
+        if full_renders:
+            render_path = Path(store) / "renders" / f"{key}.png"
+            render_path.parent.mkdir(parents=True, exist_ok=True)
+            Image.fromarray(pixels, "RGBA").save(render_path, "PNG")
+        entry = {
+            "hash": composite_hash(box, pixels),
+            "box": list(box),
+            "layers": [layer.json_path.name for layer in layers],
+            "blocks": block_hashes(box, pixels),
+        }
+        return key, entry, ""
+    except Exception as e:
+        return key, None, str(e)
+
+
+def _check_job(args: Tuple[str, List[Layer], Tuple[int, int], str, Dict]) -> Tuple[str, Optional[Dict], str]:
+    key, layers, canvas_size, store, reference = args
+    try:
+        box, pixels = render_composite(layers, canvas_size)
+        if composite_hash(box, pixels) == reference["hash"]:
+            return key, None, ""
+        current_blocks = block_hashes(box, pixels)
+        blocks = sorted(block for block in set(current_blocks) | set(reference["blocks"])
+                        if current_blocks.get(block) != reference["blocks"].get(block))
+        render_path = Path(store) / "renders" / f"{key}.png"
+        if render_path.exists():
+            with Image.open(render_path) as img:
+                stored = np.asarray(img.convert("RGBA"))
+            max_error, mean_error, changed, heatmap = compare_renders(stored, reference["box"], pixels, box)
+        else:
+            # Only the blocks are known to differ, not by how much
+            max_error, mean_error, changed = None, None, None
+            heatmap = block_heatmap(pixels, box, blocks)
+        diff_path = Path(store) / "diffs" / f"{key}.png"
+        diff_path.parent.mkdir(parents=True, exist_ok=True)
+        Image.fromarray(heatmap, "RGB").save(diff_path, "PNG", compress_level=1)
+        result = {
+            "max_error": max_error,
+            "mean_error": mean_error,
+            "changed": changed,
+            "blocks_changed": len(blocks),
+            "moved": list(box) != reference["box"],
+            "layers_changed": [layer.json_path.name for layer in layers] != reference["layers"],
+            "heatmap": str(diff_path),
+        }
+        return key, result, ""
+    except Exception as e:
+        return key, None, str(e)
+
+
+def record_references(directory: str = ".", store=None, full_renders: bool = False) -> Tuple[int, List[Tuple[str, str]]]:
+    """
+    Render every reference composite and store its hashes and thumbnail.
+
+    Args:
+        directory (str): Root of the data tree
+        store: Reference store directory (default: <directory>/.cache/regression)
+        full_renders (bool): Also store the full-resolution renders
+
+    Returns:
+        Tuple[int, List[Tuple[str, str]]]: (composites recorded, errors)
+    """
+    store = Path(store) if store else Path(directory) / DEFAULT_STORE
+    if not full_renders and (store / "renders").exists():
+        # Renders of an older recording would not match the new references
+        shutil.rmtree(store / "renders")
+    jobs = [(key, layers, canvas_size, str(store), full_renders)
+            for key, layers, canvas_size in plan_composites(directory)]
+    references = {}
+    errors = []
+    with ProcessPoolExecutor() as executor:
+        for key, entry, error in executor.map(_record_job, jobs):
+            if entry is None:
+                errors.append((key, error))
+            else:
+                references[key] = entry
+    store.mkdir(parents=True, exist_ok=True)
+    write_json(store / REFERENCES_FILENAME, references)
+    return len(references), errors
+
+
+def check_references(directory: str = ".", store=None) -> Tuple[Dict[str, Dict], List[str], List[str], List[Tuple[str, str]]]:
+    """
+    Render every composite again and compare it with the stored references.
+
+    Args:
+        directory (str): Root of the data tree
+        store: Reference store directory (default: <directory>/.cache/regression)
+
+    Returns:
+        Tuple: ({key: difference} for changed composites, keys without a
+            reference, references without a composite, errors)
+    """
+    store = Path(store) if store else Path(directory) / DEFAULT_STORE
+    references = load_json(store / REFERENCES_FILENAME)
+    plan = plan_composites(directory)
+    jobs = [(key, layers, canvas_size, str(store), references[key])
+            for key, layers, canvas_size in plan if key in references]
+    new = [key for key, _, _ in plan if key not in references]
+    missing = sorted(set(references) - {key for key, _, _ in plan})
+
+    differences = {}
+    errors = []
+    with ProcessPoolExecutor() as executor:
+        for key, result, error in executor.map(_check_job, jobs):
+            if error:
+                errors.append((key, error))
+            elif result is not None:
+                differences[key] = result
+    return differences, new, missing, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and check reference composites of every pose.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("record", "Render and store the reference composites"),
+                            ("check", "Compare current renders with the references")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+        command.add_argument("--store", help=f"Reference store (default: <directory>/{DEFAULT_STORE})")
+        if name == "record":
+            command.add_argument("--full-renders", action="store_true",
+                                 help="Also store full-resolution renders, to measure per-pixel errors")
+        if name == "check":
+            command.add_argument("--tolerance", type=int, default=0,
+                                 help="Accept changes whose per-pixel error is at most this (0-255, default: 0); "
+                                      "needs references recorded with --full-renders")
+    args = parser.parse_args()
+
+    regressed = False
+    if args.command == "record":
+        count, errors = record_references(args.directory, args.store, args.full_renders)
+        print(f"Recorded {count} reference composite(s)")
+    else:
+        try:
+            differences, new, missing, errors = check_references(args.directory, args.store)
+        except FileNotFoundError as e:
+            print(f"Error: no references found ({e.filename}); run 'record' first")
+            sys.exit(1)
+
+        # Any hash mismatch fails at tolerance 0, even one that renders identically,
+        # and so does any change that cannot be measured without a full render
+        failed = {key: d for key, d in differences.items()
+                  if args.tolerance == 0 or d["max_error"] is None
+                  or d["max_error"] > args.tolerance or d["moved"]}
+        for key, d in sorted(differences.items()):
+            notes = [note for note, flag in (("moved", d["moved"]), ("layers changed", d["layers_changed"])) if flag]
+            status = "FAIL" if key in failed else "ok  "
+            if d["max_error"] is None:
+                summary = f"{d['blocks_changed']} block(s) changed"
+            else:
+                summary = (f"max {d['max_error']}, mean {d['mean_error']:.2f}, "
+                           f"{d['changed']} pixel(s) changed")
+            print(f"  {status} {key}: {summary}{' (' + ', '.join(notes) + ')' if notes else ''}"
+                  f"  -> {d['heatmap']}")
+        for key in new:
+            print(f"  new  {key}: no reference")
+        for key in missing:
+            print(f"  gone {key}: reference without a body layer")
+        print(f"{len(differences)} composite(s) differ, {len(failed)} beyond tolerance, "
+              f"{len(new)} new, {len(missing)} gone")
+        regressed = bool(failed or missing)
+
+    if errors:
+        print("\nFailed composites:")
+        for key, error in errors:
+            print(f"  - {key}: {error}")
+    if errors or regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
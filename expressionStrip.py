@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Expression Strip
+Renders every face expression of a pose composited on one body layer, for
+flipping through a pose without opening each face in outfitEditor.
+
+Frames are produced by a generator and written as they are made, so memory
+stays bounded by one frame (plus the sheet for contact sheets):
+
+- The head region (the union of all face rectangles) is read from the body
+  once, via the tiled cache of layerTiles, and only that region is
+  re-blended per frame.
+- APNG output is streamed chunk by chunk. With --full the first frame is the
+  whole body and later frames only replace the head region.
+- Contact sheets are allocated once and each frame is pasted into its cell.
+
+Usage:
+    python expressionStrip.py POSE_DIR [--body FILE | --outfit NAME]
+                              [--apng OUT.png] [--sheet OUT.png]
+                              [--delay MS] [--columns N] [--full]
+"""
+
+import sys
+import zlib
+import struct
+import argparse
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import layerTiles
+from spriteTree import Layer, iter_layers, split_expression, split_outfit
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+DEFAULT_DELAY = 500
+DEFAULT_COLUMNS = 8
+LABEL_HEIGHT = 16
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _encode_rgba(pixels: np.ndarray) -> bytes:
+    """zlib stream of RGBA scanlines using the PNG 'Up' filter."""
+    rows = pixels.reshape(pixels.shape[0], -1)
+    up = rows.copy()
+    up[1:] -= rows[:-1]  # uint8 arithmetic wraps like the PNG filter expects
+    filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[:, 1:] = up
+    filtered[0, 0] = 0
+    filtered[0, 1:] = rows[0]
+    return zlib.compress(filtered.tobytes(), 6)
+
+
+class ApngWriter:
+    """
+    Streaming APNG writer: every frame is compressed and written as soon as
+    it is added. The frame count must be known up front (acTL chunk).
+    """
+
+    def __init__(self, path, size: Tuple[int, int], frame_count: int, delay_ms: int = DEFAULT_DELAY):
+        self.file = open(path, "wb")
+        self.size = size
+        self.delay_ms = delay_ms
+        self.sequence = 0
+        self.frames = 0
+        self.file.write(PNG_SIGNATURE)
+        self.file.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, 6, 0, 0, 0)))
+        self.file.write(_chunk(b"acTL", struct.pack(">II", frame_count, 0)))
+
+    def add_frame(self, pixels: np.ndarray, position: Tuple[int, int] = (0, 0)) -> None:
+        """
+        Write one frame.
+
+        Args:
+            pixels (np.ndarray): (height, width, 4) uint8 RGBA frame
+            position (Tuple[int, int]): Where the frame goes on the canvas;
+                later frames may cover only part of it
+        """
+        height, width = pixels.shape[:2]
+        self.file.write(_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self.sequence, width, height, position[0], position[1],
+            self.delay_ms, 1000, 0, 0)))  # dispose none, blend source
+        self.sequence += 1
+
+        data = _encode_rgba(np.ascontiguousarray(pixels))
+        if self.frames == 0:
+            self.file.write(_chunk(b"IDAT", data))
+        else:
+            self.file.write(_chunk(b"fdAT", struct.pack(">I", self.sequence) + data))
+            self.sequence += 1
+        self.frames += 1
+
+    def close(self) -> None:
+        self.file.write(_chunk(b"IEND", b""))
+        self.file.close()
+
+
+def pick_body(layers: List[Layer], body_file: Optional[str], outfit: Optional[str]) -> Layer:
+    bodies = [layer for layer in layers if layer.kind == "body" and layer.image_path]
+    if body_file:
+        bodies = [layer for layer in bodies if layer.json_path.stem == Path(body_file).stem]
+    if outfit:
+        bodies = [layer for layer in bodies if layer.data.get("outfit") == outfit]
+    if not bodies:
+        raise ValueError("No matching body layer found")
+    return bodies[0]
+
+
+def face_region(faces: List[Layer]) -> Tuple[int, int, int, int]:
+    """(left, top, right, bottom) on the canvas covering all faces."""
+    return (min(face.data["OffsetX"] for face in faces),
+            min(face.data["OffsetY"] for face in faces),
+            max(face.data["OffsetX"] + face.data["Width"] for face in faces),
+            max(face.data["OffsetY"] + face.data["Height"] for face in faces))
+
+
+def render_frames(body: Layer, faces: List[Layer], region: Tuple[int, int, int, int],
+                  root: str = ".") -> Iterator[Tuple[Layer, np.ndarray]]:
+    """
+    Yield (face, RGBA head region) frames, one face at a time.
+
+    The body is read once; each frame starts from that region and only the
+    face is blended on top.
+    """
+    left, top, right, bottom = region
+    base = Image.fromarray(layerTiles.read_canvas_region(body, region, root), "RGBA")
+    for face in faces:
+        frame = base.copy()
+        with Image.open(face.image_path) as img:
+            frame.alpha_composite(img.convert("RGBA"), dest=(face.data["OffsetX"] - left, face.data["OffsetY"] - top))
+        yield face, np.asarray(frame)
+
+
+def write_apng(path, body: Layer, faces: List[Layer], region, delay_ms: int, full: bool, root: str = ".") -> None:
+    left, top, right, bottom = region
+    if full:
+        with Image.open(body.image_path) as img:
+            full_body = np.array(img.convert("RGBA"))
+        body_x, body_y = body.data["OffsetX"], body.data["OffsetY"]
+        size = (full_body.shape[1], full_body.shape[0])
+        # Head region relative to the body image, clipped to it
+        x0, y0 = max(0, left - body_x), max(0, top - body_y)
+        x1, y1 = min(size[0], right - body_x), min(size[1], bottom - body_y)
+    else:
+        size = (right - left, bottom - top)
+
+    writer = ApngWriter(path, size, len(faces), delay_ms)
+    try:
+        for number, (face, frame) in enumerate(render_frames(body, faces, region, root)):
+            if not full:
+                writer.add_frame(frame)
+            else:
+                # Crop the frame to the part of the head region inside the body
+                crop = frame[y0 - (top - body_y):y1 - (top - body_y), x0 - (left - body_x):x1 - (left - body_x)]
+                if number == 0:
+                    full_body[y0:y1, x0:x1] = crop
+                    writer.add_frame(full_body)
+                    del full_body
+                else:
+                    writer.add_frame(crop, (x0, y0))
+            print(f"  frame {number + 1}/{len(faces)}: {face.json_path.name}")
+    finally:
+        writer.close()
+
+
+def write_sheet(path, body: Layer, faces: List[Layer], region, columns: int, root: str = ".") -> None:
+    left, top, right, bottom = region
+    cell_w, cell_h = right - left, bottom - top + LABEL_HEIGHT
+    rows = (len(faces) + columns - 1) // columns
+    sheet = Image.new("RGBA", (cell_w * min(columns, len(faces)), cell_h * rows), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(sheet)
+
+    for number, (face, frame) in enumerate(render_frames(body, faces, region, root)):
+        x, y = (number % columns) * cell_w, (number // columns) * cell_h
+        sheet.alpha_composite(Image.fromarray(frame, "RGBA"), dest=(x, y + LABEL_HEIGHT))
+        draw.text((x + 4, y + 2), face.data.get("expression", face.json_path.stem), fill=(0, 0, 0, 255))
+
+    sheet.save(path, "PNG")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render all expressions of a pose on one body.")
+    parser.add_argument("pose_dir", help="Pose directory (containing canvas.json)")
+    parser.add_argument("--root", default=".", help="Root of the data tree, for the tile cache (default: current)")
+    body_choice = parser.add_mutually_exclusive_group()
+    body_choice.add_argument("--body", help="Body layer file name (default: first body layer)")
+    body_choice.add_argument("--outfit", help="Use the body layer with this outfit")
+    parser.add_argument("--apng", help="Write an animated PNG here")
+    parser.add_argument("--sheet", help="Write a contact sheet here")
+    parser.add_argument("--delay", type=int, default=DEFAULT_DELAY, help=f"Frame delay in ms (default: {DEFAULT_DELAY})")
+    parser.add_argument("--columns", type=int, default=DEFAULT_COLUMNS,
+                        help=f"Contact sheet columns (default: {DEFAULT_COLUMNS})")
+    parser.add_argument("--full", action="store_true", help="Animate the whole body instead of the head region")
+    args = parser.parse_args()
+
+    if not args.apng and not args.sheet:
+        parser.error("nothing to do: give --apng and/or --sheet")
+
+    layers = list(iter_layers(args.pose_dir, ["body", "faces"]))
+    try:
+        body = pick_body(layers, args.body, args.outfit)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    # Skip expressions drawn for a different outfit variant than the body
+    _, body_variant = split_outfit(body.data.get("outfit", ""))
+    faces = [layer for layer in layers if layer.kind == "faces" and layer.image_path
+             and split_expression(layer.data.get("expression", ""))[1] in (None, body_variant)]
+    if not faces:
+        print("Error: no face layers to render")
+        sys.exit(1)
+
+    region = face_region(faces)
+    print(f"Rendering {len(faces)} expression(s) on {body.json_path.name} ({body.data.get('outfit')})")
+    if args.apng:
+        write_apng(args.apng, body, faces, region, args.delay, args.full, args.root)
+        print(f"Wrote {args.apng}")
+    if args.sheet:
+        write_sheet(args.sheet, body, faces, region, args.columns, args.root)
+        print(f"Wrote {args.sheet}")
+
+
+if __name__ == "__main__":
+    main()
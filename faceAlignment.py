@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Face Alignment Checker
+Flags face layers whose OffsetX/OffsetY look wrong and suggests corrected
+values, without compositing anything by hand.
+
+The faces of one pose are drawn for the same head, so the outlines of their
+eyes, brows and mouth (the alpha edges) line up across expressions. Each face
+is cross-correlated against the summed alpha edges of all other faces of its
+pose, over a small search window around its current offset; a face whose
+correlation peaks clearly away from where it is placed is misplaced by that
+shift.
+
+Each face is also checked against the body layer: the head region of the
+body is read once per pose from the tiled cache of layerTiles, and faces
+with visible pixels over transparent body pixels are flagged as well (this
+catches typos too large for the search window).
+
+Poses are checked in parallel across a process pool.
+
+Usage:
+    python faceAlignment.py [directory] [--window N] [--min-gain X] [--apply]
+"""
+
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+import layerTiles
+from spriteTree import find_pose_dirs, iter_layers, update_json_numbers
+
+DEFAULT_WINDOW = 6
+DEFAULT_MIN_GAIN = 1.2
+MAX_OFF_BODY = 0.01     # fraction of visible face pixels allowed over empty body
+
+
+def alpha_edges(alpha: np.ndarray) -> np.ndarray:
+    """Gradient magnitude of an alpha channel (central differences)."""
+    gx = np.zeros_like(alpha)
+    gy = np.zeros_like(alpha)
+    gx[:, 1:-1] = alpha[:, 2:] - alpha[:, :-2]
+    gy[1:-1] = alpha[2:] - alpha[:-2]
+    return np.hypot(gx, gy)
+
+
+def check_pose(pose_dir: str, window: int = DEFAULT_WINDOW, root: str = ".") -> List[Dict]:
+    """
+    Check the offsets of every face layer of one pose.
+
+    Args:
+        pose_dir (str): Pose directory
+        window (int): Search this many pixels around each offset
+        root (str): Root of the data tree, for the tile cache
+
+    Returns:
+        List[Dict]: One result per face with the best shift, how much better
+            it correlates than the current offset ("gain") and the fraction
+            of visible pixels over empty body ("off_body")
+    """
+    layers = [layer for layer in iter_layers(pose_dir, ["body", "faces"]) if layer.image_path]
+    faces = [layer for layer in layers if layer.kind == "faces"]
+    bodies = [layer for layer in layers if layer.kind == "body"]
+    if not faces:
+        return []
+
+    alphas = []
+    for face in faces:
+        with Image.open(face.image_path) as img:
+            alpha = img.getchannel("A") if "A" in img.getbands() else Image.new("L", img.size, 255)
+            alphas.append(np.asarray(alpha, dtype=np.float32) / 255)
+    positions = [(face.data["OffsetX"], face.data["OffsetY"]) for face in faces]
+
+    # Common frame around all faces, padded so every shifted window fits
+    left = min(x for x, _ in positions) - window
+    top = min(y for _, y in positions) - window
+    right = max(x + alpha.shape[1] for (x, _), alpha in zip(positions, alphas)) + window
+    bottom = max(y + alpha.shape[0] for (_, y), alpha in zip(positions, alphas)) + window
+
+    edges = [alpha_edges(alpha) for alpha in alphas]
+    total = np.zeros((bottom - top, right - left), dtype=np.float32)
+    for (x, y), edge in zip(positions, edges):
+        total[y - top:y - top + edge.shape[0], x - left:x - left + edge.shape[1]] += edge
+
+    body_alpha = None
+    if bodies:
+        body_alpha = layerTiles.read_canvas_region(bodies[0], (left, top, right, bottom), root)[..., 3]
+
+    results = []
+    for face, (x, y), alpha, edge in zip(faces, positions, alphas, edges):
+        h, w = edge.shape
+        fx, fy = x - left, y - top
+        search = total[fy - window:fy + h + window, fx - window:fx + w + window].copy()
+        search[window:window + h, window:window + w] -= edge  # leave the face itself out
+
+        # Correlation for every shift in the window at once
+        scores = np.einsum("ijkl,kl->ij", sliding_window_view(search, (h, w)), edge)
+        best_y, best_x = np.unravel_index(np.argmax(scores), scores.shape)
+        current = scores[window, window]
+        gain = float(scores[best_y, best_x] / current) if current > 0 else float("inf")
+
+        off_body = 0.0
+        if body_alpha is not None:
+            visible = alpha > 0.5
+            under = body_alpha[fy:fy + h, fx:fx + w]
+            off_body = float((visible & (under == 0)).sum() / max(1, visible.sum()))
+
+        results.append({
+            "path": str(face.json_path),
+            "offset": [x, y],
+            "shift": [int(best_x) - window, int(best_y) - window],
+            "gain": gain,
+            "at_edge": best_x in (0, 2 * window) or best_y in (0, 2 * window),
+            "off_body": off_body,
+        })
+    return results
+
+
+def _check_job(args: Tuple[str, int, str]) -> Tuple[str, List[Dict], str]:
+    pose_dir, window, root = args
+    try:
+        return pose_dir, check_pose(pose_dir, window, root), ""
+    except Exception as e:
+        return pose_dir, [], str(e)
+
+
+def is_misplaced(result: Dict, min_gain: float) -> bool:
+    """Whether a face result should be reported."""
+    moved = result["shift"] != [0, 0] and result["gain"] >= min_gain
+    return moved or result["off_body"] > MAX_OFF_BODY
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check face layer offsets against the other faces and the body.")
+    parser.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW,
+                        help=f"Search radius in pixels (default: {DEFAULT_WINDOW})")
+    parser.add_argument("--min-gain", type=float, default=DEFAULT_MIN_GAIN,
+                        help=f"Only report shifts that correlate this much better (default: {DEFAULT_MIN_GAIN})")
+    parser.add_argument("--apply", action="store_true", help="Write the suggested offsets to the face JSON files")
+    args = parser.parse_args()
+
+    jobs = [(str(pose_dir), args.window, args.directory) for pose_dir in find_pose_dirs(args.directory)]
+    flagged = []
+    errors = []
+    checked = 0
+    with ProcessPoolExecutor() as executor:
+        for pose_dir, results, error in executor.map(_check_job, jobs):
+            if error:
+                errors.append((pose_dir, error))
+            checked += len(results)
+            flagged.extend(result for result in results if is_misplaced(result, args.min_gain))
+
+    for result in flagged:
+        x, y = result["offset"]
+        dx, dy = result["shift"]
+        notes = []
+        if result["shift"] != [0, 0] and result["gain"] >= args.min_gain:
+            if result["gain"] == float("inf"):
+                notes.append(f"does not line up with the other faces; best match at ({x + dx}, {y + dy})")
+            else:
+                notes.append(f"correlates {result['gain']:.2f}x better at ({x + dx}, {y + dy})")
+            if result["at_edge"]:
+                notes.append("peak at the edge of the search window, try a larger --window")
+        if result["off_body"] > MAX_OFF_BODY:
+            notes.append(f"{result['off_body'] * 100:.0f}% of its pixels are outside the body")
+        print(f"  - {result['path']}: ({x}, {y}); " + "; ".join(notes))
+
+    print(f"Checked {checked} face layer(s), {len(flagged)} look misplaced")
+
+    if args.apply:
+        applied = 0
+        for result in flagged:
+            if result["shift"] == [0, 0] or result["gain"] < args.min_gain or result["at_edge"]:
+                continue
+            x, y = result["offset"]
+            update_json_numbers(result["path"], {"OffsetX": x + result["shift"][0],
+                                                 "OffsetY": y + result["shift"][1]})
+            applied += 1
+        print(f"Applied {applied} suggested offset(s)")
+
+    if errors:
+        print("\nFailed poses:")
+        for pose_dir, error in errors:
+            print(f"  - {pose_dir}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
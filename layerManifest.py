@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Layer Manifest
+Exports the layer metadata of the tree to a compact binary manifest that a
+runtime can load with a single read and no per-layer JSON parsing, and
+provides a reader for it.
+
+File layout (little-endian):
+    header          magic "LMAN", version, record count, string count,
+                    offsets of the string table, records and image data
+    string table    (count + 1) uint32 offsets followed by the UTF-8 bytes
+                    of every interned string (names, outfits, expressions,
+                    paths)
+    records         fixed-size layer records (RECORD_DTYPE): string IDs for
+                    kind, game, character, tag (outfit or expression) and
+                    path, the pose, OffsetX/OffsetY/Width/Height and the
+                    offset/length of the embedded image
+    image data      PNG bytes of every layer (only with --embed-images;
+                    otherwise offsets and lengths are 0)
+
+Usage:
+    python layerManifest.py export [directory] [-o OUTPUT] [--embed-images]
+    python layerManifest.py info MANIFEST
+    python layerManifest.py bench [directory]
+"""
+
+import os
+import sys
+import time
+import struct
+import argparse
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+from spriteTree import atomic_write, iter_all_layers
+
+MAGIC = b"LMAN"
+VERSION = 1
+DEFAULT_OUTPUT = Path(".cache") / "layers.lman"
+HEADER = struct.Struct("<4sHxxIIQQQ")
+NO_STRING = 0xFFFFFFFF
+
+# One layer record; mirrored by numpy so the reader never unpacks records
+RECORD_DTYPE = np.dtype([
+    ("kind", "<u4"),
+    ("game", "<u4"),
+    ("character", "<u4"),
+    ("tag", "<u4"),           # outfit for body layers, expression otherwise
+    ("path", "<u4"),
+    ("pose", "<u2"),
+    ("_pad", "<u2"),
+    ("offset_x", "<i4"),
+    ("offset_y", "<i4"),
+    ("width", "<u4"),
+    ("height", "<u4"),
+    ("image_offset", "<u8"),
+    ("image_length", "<u4"),
+    ("_pad2", "<u4"),
+])
+
+
+def export_manifest(directory: str = ".", output=None, embed_images: bool = False) -> int:
+    """
+    Write the binary manifest of every layer under directory.
+
+    Args:
+        directory (str): Root of the data tree
+        output: Path of the manifest to write (default: <directory>/.cache/layers.lman)
+        embed_images (bool): Append the PNG bytes of every layer
+
+    Returns:
+        int: Number of layer records written
+    """
+    strings = []
+    string_ids = {}
+
+    def intern(value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    layers = list(iter_all_layers(directory))
+    records = np.zeros(len(layers), dtype=RECORD_DTYPE)
+    for i, layer in enumerate(layers):
+        data = layer.data
+        tag = data.get("outfit") if layer.kind == "body" else data.get("expression")
+        image_path = layer.image_path or layer.json_path
+        records[i] = (
+            intern(layer.kind), intern(layer.game), intern(layer.character), intern(tag),
+            intern(Path(os.path.relpath(image_path, directory)).as_posix()), layer.pose, 0,
+            data.get("OffsetX", 0), data.get("OffsetY", 0), data.get("Width", 0), data.get("Height", 0),
+            0, 0, 0,
+        )
+
+    encoded = [s.encode("utf-8") for s in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    string_offsets[1:] = np.cumsum([len(s) for s in encoded])
+    string_table = string_offsets.tobytes() + b"".join(encoded)
+
+    strings_offset = HEADER.size
+    records_offset = strings_offset + len(string_table)
+    records_offset += -records_offset % 8  # keep records 8-byte aligned
+    images_offset = records_offset + records.nbytes
+
+    output = Path(output) if output else Path(directory) / DEFAULT_OUTPUT
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(output) as f:
+        f.write(b"\0" * records_offset)
+        if embed_images:
+            f.seek(images_offset)
+            position = images_offset
+            for i, layer in enumerate(layers):
+                if layer.image_path is None:
+                    continue
+                with open(layer.image_path, "rb") as image:
+                    payload = image.read()
+                f.write(payload)
+                records["image_offset"][i] = position
+                records["image_length"][i] = len(payload)
+                position += len(payload)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(records), len(strings),
+                            strings_offset, records_offset, images_offset if embed_images else 0))
+        f.write(string_table)
+        f.seek(records_offset)
+        f.write(records.tobytes())
+    return len(records)
+
+
+class LayerManifest:
+    """
+    Reader for a binary layer manifest.
+
+    The file is read once; records are a numpy view on that buffer, so
+    column access and filtering are vectorized and strings are only decoded
+    when asked for.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = f.read()
+        magic, version, count, string_count, strings_offset, records_offset, images_offset = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} layer manifest")
+
+        self.string_offsets = np.frombuffer(self.buffer, dtype="<u4", count=string_count + 1,
+                                            offset=strings_offset)
+        self.string_data = strings_offset + self.string_offsets.nbytes
+        self.records = np.frombuffer(self.buffer, dtype=RECORD_DTYPE, count=count, offset=records_offset)
+        self.has_images = images_offset != 0
+        self._strings = {}
+        self._ids = None
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def string(self, string_id: int) -> Optional[str]:
+        """Decode one interned string (None for missing values)."""
+        if string_id == NO_STRING:
+            return None
+        value = self._strings.get(string_id)
+        if value is None:
+            start = self.string_data + int(self.string_offsets[string_id])
+            end = self.string_data + int(self.string_offsets[string_id + 1])
+            value = self.buffer[start:end].decode("utf-8")
+            self._strings[string_id] = value
+        return value
+
+    def string_id(self, value: str) -> int:
+        """ID of an interned string, or NO_STRING if it does not occur."""
+        if self._ids is None:
+            self._ids = {self.string(i): i for i in range(len(self.string_offsets) - 1)}
+        return self._ids.get(value, NO_STRING)
+
+    def find(self, **criteria) -> np.ndarray:
+        """
+        Indices of the records matching all criteria, e.g.
+        find(character="korona", pose=2, kind="faces").
+
+        A string that does not occur in the manifest matches nothing; pass
+        None (e.g. tag=None) to match records without that value.
+
+        Returns:
+            np.ndarray: Matching record indices
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        for field, value in criteria.items():
+            if field in ("kind", "game", "character", "tag", "path"):
+                string_id = self.string_id(value)
+                if string_id == NO_STRING and value is not None:
+                    return np.empty(0, dtype=np.intp)
+                mask &= self.records[field] == string_id
+            else:
+                mask &= self.records[field] == value
+        return np.nonzero(mask)[0]
+
+    def record(self, index: int) -> Dict:
+        """One record with its strings decoded, in the shape of the layer JSON."""
+        r = self.records[index]
+        return {
+            "kind": self.string(r["kind"]),
+            "game": self.string(r["game"]),
+            "character": self.string(r["character"]),
+            "pose": int(r["pose"]),
+            "tag": self.string(r["tag"]),
+            "path": self.string(r["path"]),
+            "OffsetX": int(r["offset_x"]),
+            "OffsetY": int(r["offset_y"]),
+            "Width": int(r["width"]),
+            "Height": int(r["height"]),
+        }
+
+    def image_bytes(self, index: int) -> Optional[memoryview]:
+        """Embedded PNG bytes of a record, or None if images are not embedded."""
+        r = self.records[index]
+        if not r["image_length"]:
+            return None
+        start = int(r["image_offset"])
+        return memoryview(self.buffer)[start:start + int(r["image_length"])]
+
+
+def benchmark(directory: str = ".", repeat: int = 5) -> None:
+    """Compare loading all layer metadata from JSON against the manifest."""
+    output = Path(directory) / DEFAULT_OUTPUT
+    export_manifest(directory, output)
+
+    def best_of(function):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def from_json():
+        return [(layer.kind, layer.data.get("OffsetX"), layer.data.get("OffsetY")) for layer in iter_all_layers(directory)]
+
+    def from_manifest():
+        manifest = LayerManifest(output)
+        return manifest.records["offset_x"], manifest.records["offset_y"]
+
+    def from_manifest_records():
+        manifest = LayerManifest(output)
+        return [manifest.record(i) for i in range(len(manifest))]
+
+    json_time = best_of(from_json)
+    manifest_time = best_of(from_manifest)
+    records_time = best_of(from_manifest_records)
+    print(f"Layers:           {len(LayerManifest(output))}")
+    print(f"JSON files:       {json_time * 1000:8.2f} ms")
+    print(f"Manifest columns: {manifest_time * 1000:8.2f} ms  ({json_time / manifest_time:.0f}x, "
+          f"{os.path.getsize(output)} bytes)")
+    print(f"Manifest records: {records_time * 1000:8.2f} ms  ({json_time / records_time:.0f}x, "
+          f"every record decoded to a dict)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and inspect the binary layer manifest.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write the manifest")
+    export.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+    export.add_argument("-o", "--output", help=f"Output file (default: <directory>/{DEFAULT_OUTPUT})")
+    export.add_argument("--embed-images", action="store_true", help="Embed the PNG bytes of every layer")
+
+    info = commands.add_parser("info", help="Summarize a manifest")
+    info.add_argument("manifest", help="Manifest file")
+
+    bench = commands.add_parser("bench", help="Compare manifest loading against the JSON files")
+    bench.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        output = Path(args.output) if args.output else Path(args.directory) / DEFAULT_OUTPUT
+        count = export_manifest(args.directory, output, args.embed_images)
+        print(f"Wrote {count} layer record(s) to {output} ({os.path.getsize(output)} bytes)")
+    elif args.command == "info":
+        try:
+            manifest = LayerManifest(args.manifest)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        kinds = {}
+        for kind_id in manifest.records["kind"]:
+            kind = manifest.string(kind_id)
+            kinds[kind] = kinds.get(kind, 0) + 1
+        print(f"{len(manifest)} layer record(s), images {'embedded' if manifest.has_images else 'not embedded'}")
+        for kind, count in sorted(kinds.items()):
+            print(f"  {kind}: {count}")
+    else:
+        benchmark(args.directory)
+
+
+if __name__ == "__main__":
+    main()
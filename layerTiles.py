@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Layer Tiles
+Converts layer PNGs into a tiled cache so a rectangle (e.g. the head region
+of a ~1300x3000 body layer) can be read without decoding the whole image.
+
+Tile file layout (.cache/tiles/<game>/<character>/pose<N>/<name>.tiles),
+all integers little-endian:
+    header      magic "LTIL", version, source size, source mtime_ns,
+                width, height, tile size, tiles across, tiles down
+    index       (offset, length) for every tile, row by row
+    tiles       zlib-compressed raw RGBA rows of each tile; a length of 0
+                marks a fully transparent tile that is not stored
+
+Tiles of one tile row are stored back to back, so a region is read with one
+read per tile row it touches.
+
+Usage:
+    python layerTiles.py [directory] [--kinds body faces ...] [--force]
+"""
+
+import os
+import sys
+import zlib
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from spriteTree import Layer, atomic_write, iter_all_layers
+
+CACHE_DIR = Path(".cache") / "tiles"
+MAGIC = b"LTIL"
+VERSION = 1
+TILE_SIZE = 128
+HEADER = struct.Struct("<4sHxxQqIIIII")
+INDEX_ENTRY = struct.Struct("<QI")
+# zlib level 1 keeps conversion fast; tiles are decoded far more often
+COMPRESS_LEVEL = 1
+
+
+def tile_path(image_path, root=".") -> Path:
+    """
+    Path of the tile file of an image.
+
+    Args:
+        image_path: Path to the source image
+        root: Root of the data tree
+
+    Returns:
+        Path: Path of the tile file in the cache
+    """
+    relative = Path(os.path.relpath(os.path.abspath(image_path), os.path.abspath(root)))
+    return Path(root) / CACHE_DIR / relative.with_suffix(".tiles")
+
+
+def convert_layer(image_path, root=".") -> Path:
+    """
+    Convert one image into a tile file.
+
+    Args:
+        image_path: Path to the source image
+        root: Root of the data tree
+
+    Returns:
+        Path: Path of the written tile file
+    """
+    stat = os.stat(image_path)
+    with Image.open(image_path) as img:
+        rgba = np.asarray(img.convert("RGBA"))
+    height, width = rgba.shape[:2]
+    tiles_x = (width + TILE_SIZE - 1) // TILE_SIZE
+    tiles_y = (height + TILE_SIZE - 1) // TILE_SIZE
+
+    index = []
+    chunks = []
+    offset = HEADER.size + INDEX_ENTRY.size * tiles_x * tiles_y
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            tile = rgba[ty * TILE_SIZE:(ty + 1) * TILE_SIZE, tx * TILE_SIZE:(tx + 1) * TILE_SIZE]
+            if not tile[..., 3].any():
+                index.append((0, 0))
+                continue
+            data = zlib.compress(np.ascontiguousarray(tile).tobytes(), COMPRESS_LEVEL)
+            index.append((offset, len(data)))
+            chunks.append(data)
+            offset += len(data)
+
+    target = tile_path(image_path, root)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(target) as f:
+        f.write(HEADER.pack(MAGIC, VERSION, stat.st_size, stat.st_mtime_ns,
+                            width, height, TILE_SIZE, tiles_x, tiles_y))
+        f.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+        f.write(b"".join(chunks))
+    return target
+
+
+def _read_header(f, image_path) -> Optional[Tuple[int, int, int, int, int]]:
+    """Read and validate a tile file header; None if it is stale or foreign."""
+    raw = f.read(HEADER.size)
+    if len(raw) != HEADER.size:
+        return None
+    magic, version, size, mtime_ns, width, height, tile, tiles_x, tiles_y = HEADER.unpack(raw)
+    if magic != MAGIC or version != VERSION:
+        return None
+    stat = os.stat(image_path)
+    if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return width, height, tile, tiles_x, tiles_y
+
+
+def image_size(image_path, root=".") -> Tuple[int, int]:
+    """Size of a layer image, from its tile header when available."""
+    try:
+        with open(tile_path(image_path, root), "rb") as f:
+            header = _read_header(f, image_path)
+        if header:
+            return header[0], header[1]
+    except FileNotFoundError:
+        pass
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def read_region(image_path, box: Tuple[int, int, int, int], root=".", convert: bool = True) -> np.ndarray:
+    """
+    Read a rectangle of a layer image as an RGBA array.
+
+    Only the tiles overlapping the rectangle are read and decompressed.
+    Parts of the rectangle outside the image are transparent. A missing or
+    stale tile file is rebuilt first (or, with convert=False, the full image
+    is decoded instead).
+
+    Args:
+        image_path: Path to the source image
+        box (Tuple[int, int, int, int]): (left, top, right, bottom) in image
+            pixels, right/bottom exclusive
+        root: Root of the data tree
+        convert (bool): Build the tile file if it is missing or stale
+
+    Returns:
+        np.ndarray: (bottom - top, right - left, 4) uint8 array
+    """
+    left, top, right, bottom = box
+    out = np.zeros((max(0, bottom - top), max(0, right - left), 4), dtype=np.uint8)
+    if out.size == 0:
+        return out
+
+    path = tile_path(image_path, root)
+    header = None
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        f = None
+    if f is not None:
+        header = _read_header(f, image_path)
+        if header is None:
+            f.close()
+            f = None
+
+    if f is None:
+        if not convert:
+            # No usable tiles: decode the whole image and crop
+            with Image.open(image_path) as img:
+                rgba = np.asarray(img.convert("RGBA"))
+            _blit(out, rgba, 0, 0, left, top)
+            return out
+        convert_layer(image_path, root)
+        f = open(path, "rb")
+        header = _read_header(f, image_path)
+
+    with f:
+        width, height, tile, tiles_x, tiles_y = header
+        tx0, tx1 = max(0, left // tile), min(tiles_x - 1, (right - 1) // tile)
+        ty0, ty1 = max(0, top // tile), min(tiles_y - 1, (bottom - 1) // tile)
+        if tx0 > tx1 or ty0 > ty1:
+            return out
+
+        for ty in range(ty0, ty1 + 1):
+            # Index entries of this tile row, then one read for their data
+            f.seek(HEADER.size + INDEX_ENTRY.size * (ty * tiles_x + tx0))
+            raw_index = f.read(INDEX_ENTRY.size * (tx1 - tx0 + 1))
+            entries = [INDEX_ENTRY.unpack_from(raw_index, i * INDEX_ENTRY.size) for i in range(tx1 - tx0 + 1)]
+            stored = [(o, n) for o, n in entries if n]
+            if not stored:
+                continue
+            start = stored[0][0]
+            f.seek(start)
+            row_data = f.read(stored[-1][0] + stored[-1][1] - start)
+
+            tile_h = min(tile, height - ty * tile)
+            for i, (offset, length) in enumerate(entries):
+                if not length:
+                    continue
+                tx = tx0 + i
+                tile_w = min(tile, width - tx * tile)
+                pixels = np.frombuffer(zlib.decompress(row_data[offset - start:offset - start + length]),
+                                       dtype=np.uint8).reshape(tile_h, tile_w, 4)
+                _blit(out, pixels, tx * tile, ty * tile, left, top)
+    return out
+
+
+def _blit(out: np.ndarray, pixels: np.ndarray, x: int, y: int, left: int, top: int) -> None:
+    """Copy pixels placed at (x, y) into out, whose origin is (left, top)."""
+    src_x0, src_y0 = max(0, left - x), max(0, top - y)
+    dst_x0, dst_y0 = max(0, x - left), max(0, y - top)
+    w = min(pixels.shape[1] - src_x0, out.shape[1] - dst_x0)
+    h = min(pixels.shape[0] - src_y0, out.shape[0] - dst_y0)
+    if w > 0 and h > 0:
+        out[dst_y0:dst_y0 + h, dst_x0:dst_x0 + w] = pixels[src_y0:src_y0 + h, src_x0:src_x0 + w]
+
+
+def read_canvas_region(layer: Layer, box: Tuple[int, int, int, int], root=".") -> np.ndarray:
+    """
+    Read a rectangle given in canvas coordinates from a layer, using the
+    layer's OffsetX/OffsetY.
+
+    Args:
+        layer (Layer): The layer to read
+        box (Tuple[int, int, int, int]): (left, top, right, bottom) on the canvas
+        root: Root of the data tree
+
+    Returns:
+        np.ndarray: RGBA array of the rectangle
+    """
+    dx, dy = layer.data.get("OffsetX", 0), layer.data.get("OffsetY", 0)
+    left, top, right, bottom = box
+    return read_region(layer.image_path, (left - dx, top - dy, right - dx, bottom - dy), root)
+
+
+def _convert_job(args: Tuple[str, str]) -> Tuple[str, str]:
+    image_path, root = args
+    try:
+        convert_layer(image_path, root)
+        return image_path, ""
+    except Exception as e:
+        return image_path, str(e)
+
+
+def is_fresh(image_path, root=".") -> bool:
+    """Whether an image has an up-to-date tile file."""
+    try:
+        with open(tile_path(image_path, root), "rb") as f:
+            return _read_header(f, image_path) is not None
+    except FileNotFoundError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert layer PNGs to the tiled cache format.")
+    parser.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+    parser.add_argument("--kinds", nargs="+", default=["body"],
+                        help="Layer kinds to convert (default: body)")
+    parser.add_argument("--force", action="store_true", help="Convert even up-to-date layers")
+    args = parser.parse_args()
+
+    jobs = []
+    up_to_date = 0
+    for layer in iter_all_layers(args.directory, args.kinds):
+        if layer.image_path is None:
+            continue
+        if not args.force and is_fresh(layer.image_path, args.directory):
+            up_to_date += 1
+            continue
+        jobs.append((str(layer.image_path), args.directory))
+
+    with ProcessPoolExecutor() as executor:
+        errors = [(path, error) for path, error in executor.map(_convert_job, jobs, chunksize=4) if error]
+
+    print(f"Converted {len(jobs) - len(errors)} layer(s), {up_to_date} already up to date.")
+    if errors:
+        print("\nFailed layers:")
+        for path, error in errors:
+            print(f"  - {path}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
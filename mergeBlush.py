@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Blush Merger
+Pre-merges every face expression with every blush overlay of the same pose,
+so a runtime can show a blushing expression as one layer instead of
+decoding and blending two.
+
+A face and a blush are combined when their outfit variants are compatible:
+an expression like "018 (a only)" only pairs with blushes that are
+unrestricted or also limited to variant a.
+
+Each merged image is cropped to the union of the two layer rectangles and
+written with a layer JSON carrying the canvas offset:
+    .cache/merged/<game>/<character>/pose<N>/<face>+<blush>.png/.json
+Merged layers whose inputs did not change since the last run are skipped.
+
+Usage:
+    python mergeBlush.py [directory] [-o OUTPUT] [--force]
+"""
+
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+from spriteTree import Layer, atomic_write, find_pose_dirs, iter_layers, split_expression, write_json
+
+DEFAULT_OUTPUT = Path(".cache") / "merged"
+
+
+def compatible(face: Layer, blush: Layer) -> bool:
+    """Whether a face and a blush may be shown together (outfit variants agree)."""
+    _, face_variant = split_expression(face.data.get("expression", ""))
+    _, blush_variant = split_expression(blush.data.get("expression", ""))
+    return face_variant is None or blush_variant is None or face_variant == blush_variant
+
+
+def union_box(rects: List[Tuple[int, int, int, int]]) -> Tuple[int, int, int, int]:
+    """(left, top, right, bottom) covering all (x, y, width, height) rects."""
+    left = min(x for x, _, _, _ in rects)
+    top = min(y for _, y, _, _ in rects)
+    right = max(x + w for x, _, w, _ in rects)
+    bottom = max(y + h for _, y, _, h in rects)
+    return left, top, right, bottom
+
+
+def merge_pair(face: Layer, blush: Layer, output_path: Path) -> Dict:
+    """
+    Composite a blush over a face and write the merged layer.
+
+    Args:
+        face (Layer): Face expression layer
+        blush (Layer): Blush layer
+        output_path (Path): Path of the merged PNG (the JSON goes next to it)
+
+    Returns:
+        Dict: The layer JSON written for the merged image
+    """
+    images = []
+    for layer in (face, blush):
+        with Image.open(layer.image_path) as img:
+            images.append((img.convert("RGBA"), layer.data["OffsetX"], layer.data["OffsetY"]))
+
+    # Actual image sizes win over Width/Height, which are occasionally off by one
+    left, top, right, bottom = union_box([(x, y, img.width, img.height) for img, x, y in images])
+    merged = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+    for img, x, y in images:
+        merged.alpha_composite(img, dest=(x - left, y - top))
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(output_path) as f:
+        merged.save(f, "PNG")
+
+    data = {
+        "expression": face.data.get("expression"),
+        "blush": blush.data.get("expression"),
+        "OffsetX": left,
+        "OffsetY": top,
+        "Width": right - left,
+        "Height": bottom - top,
+    }
+    write_json(output_path.with_suffix(".json"), data)
+    return data
+
+
+def is_up_to_date(output_path: Path, inputs: List[Layer]) -> bool:
+    """Whether a merged layer is newer than all of its input files."""
+    json_path = output_path.with_suffix(".json")
+    try:
+        built = min(os.stat(output_path).st_mtime_ns, os.stat(json_path).st_mtime_ns)
+    except FileNotFoundError:
+        return False
+    for layer in inputs:
+        for path in (layer.json_path, layer.image_path):
+            if os.stat(path).st_mtime_ns > built:
+                return False
+    return True
+
+
+def _merge_job(args: Tuple[Layer, Layer, Path]) -> Tuple[str, str]:
+    face, blush, output_path = args
+    try:
+        merge_pair(face, blush, output_path)
+        return str(output_path), ""
+    except Exception as e:
+        return str(output_path), str(e)
+
+
+def plan_merges(directory: str, output: Path) -> List[Tuple[Layer, Layer, Path]]:
+    """
+    List every valid (face, blush, output path) combination under directory.
+
+    Args:
+        directory (str): Root of the data tree
+        output (Path): Root of the merged layer output
+
+    Returns:
+        List[Tuple[Layer, Layer, Path]]: Combinations to merge
+    """
+    plan = []
+    for pose_dir in find_pose_dirs(directory):
+        layers = list(iter_layers(pose_dir, ["faces", "blush"]))
+        faces = [layer for layer in layers if layer.kind == "faces" and layer.image_path]
+        blushes = [layer for layer in layers if layer.kind == "blush" and layer.image_path]
+        target_dir = output / os.path.relpath(pose_dir, directory)
+        for face in faces:
+            for blush in blushes:
+                if compatible(face, blush):
+                    name = f"{face.json_path.stem}+{blush.json_path.stem}.png"
+                    plan.append((face, blush, target_dir / name))
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-merge face expressions with their blush overlays.")
+    parser.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+    parser.add_argument("-o", "--output", help=f"Output directory (default: <directory>/{DEFAULT_OUTPUT})")
+    parser.add_argument("--force", action="store_true", help="Rebuild up-to-date merged layers")
+    args = parser.parse_args()
+
+    output = Path(args.output) if args.output else Path(args.directory) / DEFAULT_OUTPUT
+    plan = plan_merges(args.directory, output)
+    jobs = [job for job in plan if args.force or not is_up_to_date(job[2], [job[0], job[1]])]
+
+    with ProcessPoolExecutor() as executor:
+        errors = [(path, error) for path, error in executor.map(_merge_job, jobs, chunksize=8) if error]
+
+    print(f"Merged {len(jobs) - len(errors)} face+blush layer(s), "
+          f"{len(plan) - len(jobs)} already up to date, into {output}")
+    if errors:
+        print("\nFailed merges:")
+        for path, error in errors:
+            print(f"  - {path}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,72 @@
 from PIL import Image
+import numpy as np
 import os
 
+# Minimum number of semi-transparent pixels needed before a layer is classified
+MIN_EDGE_SAMPLES = 64
+# Upper bound on sampled edge pixels; larger layers are strided down to this
+MAX_EDGE_SAMPLES = 200000
+# Fraction of edge pixels allowed to have a color channel above alpha
+VIOLATION_LIMIT = 0.005
+# Layers scoring below this confidence are left untouched by the batch tool
+DEFAULT_MIN_CONFIDENCE = 0.5
+
+def detect_premultiplied(img):
+    """
+    Classifies an RGBA image as premultiplied or straight alpha.
+
+    Only semi-transparent pixels carry information, so those are sampled.
+    Two checks are combined:
+
+    - In a premultiplied image no color channel can exceed alpha, so any
+      pixel where one does is evidence of straight alpha.
+    - In a premultiplied image edge colors scale with alpha, so the slope of
+      log(max channel) against log(alpha) is close to 1. Straight alpha
+      edges keep their color as alpha fades, giving a slope near 0.
+
+    Args:
+        img (PIL.Image.Image): The image to classify.
+
+    Returns:
+        tuple[bool, float]: (is_premultiplied, confidence in [0, 1]).
+        Confidence is 0.0 when there are too few edge pixels to decide.
+    """
+    rgba = np.asarray(img.convert("RGBA"))
+    alpha = rgba[..., 3]
+    edge = rgba[(alpha > 0) & (alpha < 255)]
+
+    if len(edge) < MIN_EDGE_SAMPLES:
+        return False, 0.0
+    if len(edge) > MAX_EDGE_SAMPLES:
+        edge = edge[::len(edge) // MAX_EDGE_SAMPLES + 1]
+
+    peak = edge[:, :3].max(axis=1).astype(np.float32)
+    a = edge[:, 3].astype(np.float32)
+
+    violation_rate = np.count_nonzero(peak > a + 1) / len(edge)
+
+    # Black edge pixels say nothing about scaling and break the log
+    lit = peak > 0
+    if np.count_nonzero(lit) < MIN_EDGE_SAMPLES:
+        slope = 0.0
+    else:
+        log_peak = np.log(peak[lit])
+        log_alpha = np.log(a[lit])
+        variance = float(np.var(log_alpha))
+        covariance = float(np.mean((log_peak - log_peak.mean()) * (log_alpha - log_alpha.mean())))
+        slope = covariance / variance if variance > 0 else 0.0
+
+    # Map the slope to [0, 1]: <= 0.2 looks straight, >= 0.8 looks premultiplied
+    slope_score = min(1.0, max(0.0, (slope - 0.2) / 0.6))
+    sample_factor = min(1.0, len(edge) / (MIN_EDGE_SAMPLES * 8))
+
+    if violation_rate <= VIOLATION_LIMIT and slope_score >= 0.5:
+        confidence = slope_score * (1.0 - violation_rate / VIOLATION_LIMIT)
+        return True, round(float(confidence * sample_factor), 3)
+
+    confidence = max(min(1.0, violation_rate / VIOLATION_LIMIT / 10), 1.0 - slope_score)
+    return False, round(float(confidence * sample_factor), 3)
+
 def unpremultiply_image(image_path, output_path):
     """
     Unpremultiplies the alpha channel of an RGBA or LA image.
@@ -28,33 +94,20 @@ def unpremultiply_image(image_path, output_path):
         return False
 
     # Convert to RGBA for consistent pixel access
-    img = img.convert("RGBA")
-    pixels = img.load()
-    width, height = img.size
-
-    # Create a new image to store the unpremultiplied data
-    new_img = Image.new('RGBA', (width, height))
-    new_pixels = new_img.load()
-
-    for y in range(height):
-        for x in range(width):
-            r, g, b, a = pixels[x, y]
-            
-            # Unpremultiply the color channels
-            # Avoid division by zero by checking for alpha > 0
-            if a > 0:
-                # Normalizing the alpha to a float from 0.0 to 1.0
-                a_norm = a / 255.0
-                
-                # Apply the unpremultiply formula: color / alpha_norm
-                r_new = min(255, int(r / a_norm))
-                g_new = min(255, int(g / a_norm))
-                b_new = min(255, int(b / a_norm))
-                
-                new_pixels[x, y] = (r_new, g_new, b_new, a)
-            else:
-                # If alpha is zero, the color should be too
-                new_pixels[x, y] = (0, 0, 0, 0)
+    rgba = np.asarray(img.convert("RGBA"))
+    color = rgba[..., :3].astype(np.float64)
+    alpha = rgba[..., 3:4]
+
+    # Normalizing the alpha to a float from 0.0 to 1.0
+    # Avoid division by zero; fully transparent pixels end up as (0, 0, 0, 0)
+    a_norm = np.maximum(alpha, 1) / 255.0
+
+    # Apply the unpremultiply formula: color / alpha_norm
+    unpremultiplied = np.minimum(color / a_norm, 255).astype(np.uint8)
+    unpremultiplied[alpha[..., 0] == 0] = 0
+
+    out = np.concatenate([unpremultiplied, alpha], axis=2)
+    new_img = Image.fromarray(out, "RGBA")
     
     # Save the new unpremultiplied image
     try:
@@ -65,12 +118,18 @@ def unpremultiply_image(image_path, output_path):
         print(f"Error saving image to {output_path}: {e}")
         return False
 
-def unpremultiply_folder_recursive(folder_path):
+def unpremultiply_folder_recursive(folder_path, min_confidence=DEFAULT_MIN_CONFIDENCE):
     """
-    Recursively finds and unpremultiplies all PNG images in a folder.
+    Recursively finds PNG images in a folder and unpremultiplies the ones
+    detected as premultiplied.
+
+    Straight-alpha layers, and layers the detector is not confident about,
+    are reported and left untouched.
     
     Args:
         folder_path (str): The starting directory path.
+        min_confidence (float): Minimum detection confidence needed to
+            process a layer.
     """
     if not os.path.isdir(folder_path):
         print(f"Error: Directory not found at {folder_path}")
@@ -80,25 +139,51 @@ def unpremultiply_folder_recursive(folder_path):
     print("-" * 50)
 
     png_files_found = False
+    processed = []
+    skipped = []
 
     # Walk through the directory and all subdirectories
     for root, dirs, files in os.walk(folder_path):
         for filename in files:
-            if filename.lower().endswith('.png'):
+            # Outputs of a previous run are straight alpha by construction
+            if filename.lower().endswith('.png') and not filename.startswith('unpr_'):
                 png_files_found = True
                 
                 # Construct the full file paths
                 original_path = os.path.join(root, filename)
+
+                try:
+                    with Image.open(original_path) as img:
+                        if img.mode not in ('RGBA', 'LA'):
+                            skipped.append((original_path, "no alpha", 0.0))
+                            continue
+                        is_premultiplied, confidence = detect_premultiplied(img)
+                except Exception as e:
+                    print(f"Error opening image {original_path}: {e}")
+                    continue
+
+                if not is_premultiplied or confidence < min_confidence:
+                    verdict = "straight" if not is_premultiplied else "uncertain"
+                    skipped.append((original_path, verdict, confidence))
+                    continue
                 
                 # Create the output filename with a suffix
                 name, ext = os.path.splitext(filename)
                 output_filename = f"unpr_{name}{ext}"
                 output_path = os.path.join(root, output_filename)
                 
-                unpremultiply_image(original_path, output_path)
+                print(f"Premultiplied (confidence {confidence:.2f}): {original_path}")
+                if unpremultiply_image(original_path, output_path):
+                    processed.append((original_path, confidence))
 
     if not png_files_found:
         print("No PNG files found in the specified directory or its subdirectories.")
+        return
+
+    print("-" * 50)
+    print(f"Processed {len(processed)} premultiplied layer(s), skipped {len(skipped)}.")
+    for path, verdict, confidence in skipped:
+        print(f"  - skipped ({verdict}, confidence {confidence:.2f}): {path}")
 
 if __name__ == "__main__":
     # Specify the root directory to start the recursive search
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Outfit Tagger
+Proposes "outfit" tags for untagged body layers by comparing them with the
+already tagged layers of the same character, and writes the accepted
+proposals in one batch. outfitEditor can then be used only to review them.
+
+An outfit tag is a base name plus an optional variant letter
+(wUniCoat + _a). The two parts are proposed separately:
+
+- Base name: each layer is reduced to a color histogram of its opaque
+  pixels, which is stable across poses and variants. Untagged layers take
+  the base name voted by their nearest tagged neighbours.
+- Variant letter: within a pose, layers of the same base are numbered in
+  filename order (..._005 is _a, ..._006 is _b), skipping letters already
+  used by tagged layers. A lone layer takes the variant of the tagged layer
+  with the closest silhouette.
+
+Untagged layers unlike anything tagged are grouped among themselves so each
+group only has to be named once.
+
+Usage:
+    python outfitTagger.py [directory] [--apply] [--all] [--min-confidence X]
+"""
+
+import sys
+import string
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from spriteTree import Layer, find_pose_dirs, iter_layers, load_json, split_outfit, write_json, CANVAS_FILENAME
+
+# Silhouette grid the whole canvas is reduced to (width, height); poses are tall
+GRID_SIZE = (32, 80)
+# Color histogram bins per channel
+HIST_BINS = 8
+# Number of tagged neighbours that vote on a base name
+NEIGHBOURS = 3
+# Untagged layers farther than this from every tagged layer are grouped as new
+NEW_GROUP_DISTANCE = 0.5
+DEFAULT_MIN_CONFIDENCE = 0.5
+
+def layer_descriptor(image_path: str, offset: Tuple[int, int],
+                     canvas_size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the feature descriptors of one body layer.
+
+    Args:
+        image_path (str): Path to the layer image
+        offset (Tuple[int, int]): OffsetX/OffsetY of the layer on the canvas
+        canvas_size (Tuple[int, int]): ImageWidth/ImageHeight of the canvas
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (color histogram, silhouette grid),
+            both flat float32 vectors
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        img = img.convert("RGBA")
+        # Work on a reduced copy; the descriptors never need full resolution
+        rgba = np.asarray(img.reduce(4) if min(width, height) >= 16 else img)
+
+    # Color histogram of the opaque pixels (square root damps large areas)
+    opaque = rgba[rgba[..., 3] > 128][:, :3] // (256 // HIST_BINS)
+    hist = np.zeros(HIST_BINS ** 3, dtype=np.float32)
+    if len(opaque):
+        codes = (opaque[:, 0].astype(np.int32) * HIST_BINS + opaque[:, 1]) * HIST_BINS + opaque[:, 2]
+        hist += np.sqrt(np.bincount(codes, minlength=HIST_BINS ** 3) / len(opaque))
+
+    # Alpha mask placed on the canvas grid
+    scale_x = GRID_SIZE[0] / canvas_size[0]
+    scale_y = GRID_SIZE[1] / canvas_size[1]
+    small = Image.fromarray(rgba[..., 3]).resize(
+        (max(1, round(width * scale_x)), max(1, round(height * scale_y))), Image.Resampling.BOX)
+    grid = Image.new("L", GRID_SIZE, 0)
+    grid.paste(small, (round(offset[0] * scale_x), round(offset[1] * scale_y)))
+    silhouette = np.asarray(grid, dtype=np.float32).ravel() / 255.0
+
+    return hist, silhouette
+
+
+def _descriptor_job(args: Tuple[str, Tuple[int, int], Tuple[int, int]]):
+    image_path, offset, canvas_size = args
+    try:
+        return layer_descriptor(image_path, offset, canvas_size)
+    except Exception as e:
+        print(f"Error reading {image_path}: {e}")
+        return None
+
+
+def group_untagged(descriptors: np.ndarray, threshold: float) -> List[int]:
+    """
+    Group descriptors whose pairwise distance is below threshold
+    (connected components of the distance graph).
+
+    Args:
+        descriptors (np.ndarray): (N, D) descriptor matrix
+        threshold (float): Maximum distance for two layers to be linked
+
+    Returns:
+        List[int]: Group number for each descriptor
+    """
+    distances = np.linalg.norm(descriptors[:, None, :] - descriptors[None, :, :], axis=2)
+    linked = distances < threshold
+
+    groups = [-1] * len(descriptors)
+    next_group = 0
+    for start in range(len(descriptors)):
+        if groups[start] != -1:
+            continue
+        stack = [start]
+        groups[start] = next_group
+        while stack:
+            current = stack.pop()
+            for other in np.nonzero(linked[current])[0]:
+                if groups[other] == -1:
+                    groups[other] = next_group
+                    stack.append(other)
+        next_group += 1
+    return groups
+
+
+def propose_character(layers: List[Layer], hists: np.ndarray, silhouettes: np.ndarray,
+                      retag_all: bool) -> List[Dict]:
+    """
+    Propose outfit tags for the body layers of one character (all poses).
+
+    Args:
+        layers (List[Layer]): Body layers of the character
+        hists (np.ndarray): (N, D) color histograms
+        silhouettes (np.ndarray): (N, D) silhouette grids
+        retag_all (bool): Also propose tags for already tagged layers, each
+            compared against all the others, for auditing
+
+    Returns:
+        List[Dict]: One proposal per layer needing a tag, with keys
+            layer, current, label, confidence, group
+    """
+    tagged = [i for i, layer in enumerate(layers) if layer.data.get("outfit")]
+    targets = list(range(len(layers))) if retag_all else [i for i in range(len(layers)) if i not in tagged]
+    if not targets:
+        return []
+
+    base_of = {i: split_outfit(layers[i].data["outfit"])[0] for i in tagged}
+
+    # Base names: inverse-distance vote of the nearest tagged neighbours
+    guesses = {}
+    unmatched = []
+    if tagged:
+        distances = np.linalg.norm(hists[targets][:, None, :] - hists[tagged][None, :, :], axis=2)
+    for row, index in enumerate(targets):
+        order = [] if not tagged else [j for j in np.argsort(distances[row]) if tagged[j] != index][:NEIGHBOURS]
+        if not order or distances[row][order[0]] > NEW_GROUP_DISTANCE:
+            unmatched.append(index)
+            continue
+        votes = Counter()
+        for j in order:
+            votes[base_of[tagged[j]]] += 1.0 / (float(distances[row][j]) + 1e-3)
+        (base, best), *rest = votes.most_common()
+        runner_up = rest[0][1] if rest else 0.0
+        guesses[index] = (base, round((best - runner_up) / best, 3))
+
+    # Variant letters: per pose and base, in filename order
+    proposals = []
+    members = defaultdict(list)
+    for index, (base, _) in guesses.items():
+        members[(layers[index].pose, base)].append(index)
+
+    for (pose, base), group in members.items():
+        group.sort(key=lambda i: layers[i].json_path.name)
+        taken = {split_outfit(layers[i].data["outfit"])[1] for i in tagged
+                 if layers[i].pose == pose and base_of[i] == base and i not in group}
+        free = [letter for letter in string.ascii_lowercase if letter not in taken]
+
+        if len(group) > 1 or taken:
+            # A lone layer next to tagged variants of this pose takes the
+            # variant of the one with the closest silhouette
+            peers = [i for i in tagged if layers[i].pose == pose and i != group[0]
+                     and split_outfit(layers[i].data["outfit"])[1] not in (None, *taken)]
+            if len(group) == 1 and peers:
+                nearest = min(peers, key=lambda i: float(np.linalg.norm(silhouettes[i] - silhouettes[group[0]])))
+                letters = [split_outfit(layers[nearest].data["outfit"])[1]]
+            else:
+                letters = free[:len(group)]
+            labels = [f"{base}_{letter}" for letter in letters]
+        else:
+            labels = [base]
+
+        for index, label in zip(group, labels):
+            proposals.append({
+                "layer": layers[index],
+                "current": layers[index].data.get("outfit", ""),
+                "label": label,
+                "confidence": guesses[index][1],
+                "group": base,
+            })
+
+    # Layers unlike anything tagged: group them so each group is named once
+    if unmatched:
+        for index, group in zip(unmatched, group_untagged(hists[unmatched], NEW_GROUP_DISTANCE)):
+            proposals.append({
+                "layer": layers[index],
+                "current": layers[index].data.get("outfit", ""),
+                "label": None,
+                "confidence": 0.0,
+                "group": f"new group {group + 1}",
+            })
+
+    return proposals
+
+
+def propose_labels(directory: str, retag_all: bool = False) -> List[Dict]:
+    """
+    Propose outfit tags for every character under directory.
+
+    Args:
+        directory (str): Directory to search for poses
+        retag_all (bool): Also propose tags for already tagged layers
+
+    Returns:
+        List[Dict]: Proposals from all characters (see propose_character)
+    """
+    characters = defaultdict(list)
+    jobs = []
+    for pose_dir in find_pose_dirs(directory):
+        canvas = load_json(pose_dir / CANVAS_FILENAME)
+        canvas_size = (canvas["ImageWidth"], canvas["ImageHeight"])
+        for layer in iter_layers(pose_dir, ["body"]):
+            if layer.image_path is None:
+                continue
+            characters[(layer.game, layer.character)].append(layer)
+            offset = (layer.data.get("OffsetX", 0), layer.data.get("OffsetY", 0))
+            jobs.append((str(layer.image_path), offset, canvas_size))
+
+    # Nothing to do unless something is untagged
+    if not retag_all and all(layer.data.get("outfit") for layers in characters.values() for layer in layers):
+        return []
+
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(_descriptor_job, jobs, chunksize=4)
+        descriptors = {job[0]: result for job, result in zip(jobs, results)}
+
+    proposals = []
+    for layers in characters.values():
+        usable = [(layer, descriptors[str(layer.image_path)]) for layer in layers]
+        usable = [(layer, d) for layer, d in usable if d is not None]
+        if not usable:
+            continue
+        hists = np.stack([d[0] for _, d in usable])
+        silhouettes = np.stack([d[1] for _, d in usable])
+        proposals.extend(propose_character([layer for layer, _ in usable], hists, silhouettes, retag_all))
+    return proposals
+
+
+def apply_proposals(proposals: List[Dict], min_confidence: float) -> int:
+    """
+    Write the confident proposals to their layer JSON files in one batch.
+
+    Args:
+        proposals (List[Dict]): Proposals from propose_labels
+        min_confidence (float): Minimum confidence for a tag to be written
+
+    Returns:
+        int: Number of files written
+    """
+    updates = []
+    for proposal in proposals:
+        if proposal["label"] is None or proposal["confidence"] < min_confidence:
+            continue
+        if proposal["label"] == proposal["current"]:
+            continue
+        data = load_json(proposal["layer"].json_path)
+        data["outfit"] = proposal["label"]
+        updates.append((proposal["layer"].json_path, data))
+
+    for json_path, data in updates:
+        write_json(json_path, data)
+    return len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose outfit tags for untagged body layers.")
+    parser.add_argument("directory", nargs="?", default=".", help="Directory to search (default: current)")
+    parser.add_argument("--apply", action="store_true", help="Write confident proposals to the JSON files")
+    parser.add_argument("--all", action="store_true", help="Also check already tagged layers")
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help=f"Minimum confidence to apply a tag (default: {DEFAULT_MIN_CONFIDENCE})")
+    args = parser.parse_args()
+
+    proposals = propose_labels(args.directory, retag_all=args.all)
+    if args.all:
+        # When auditing, only disagreements are interesting
+        proposals = [p for p in proposals if p["label"] != p["current"]]
+
+    if not proposals:
+        print("Nothing to tag.")
+        return
+
+    by_group = defaultdict(list)
+    for proposal in proposals:
+        layer = proposal["layer"]
+        by_group[(layer.game, layer.character, layer.pose, proposal["group"])].append(proposal)
+
+    print("-" * 60)
+    for (game, character, pose, group), members in sorted(by_group.items()):
+        print(f"{game}/{character}/pose{pose}: {group} ({len(members)} layer(s))")
+        for proposal in members:
+            label = proposal["label"] or "?"
+            current = f" (currently '{proposal['current']}')" if proposal["current"] else ""
+            print(f"    {proposal['layer'].json_path.name} -> {label}  "
+                  f"confidence {proposal['confidence']:.2f}{current}")
+    print("-" * 60)
+
+    if args.apply:
+        written = apply_proposals(proposals, args.min_confidence)
+        print(f"Wrote {written} outfit tag(s).")
+    else:
+        print("Dry run; use --apply to write the proposals.")
+
+    # Exit with an error code if some layers still need a human
+    if any(p["label"] is None for p in proposals):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Tree Reconciler
+Checks gamelist.json and every canvas.json against the directories that
+actually exist, and optionally regenerates gamelist.json from the tree.
+
+The expected tree is built from gamelist.json (games, characters, poses) and
+the canvas.json of each pose (game/character/pose and "extras" folders);
+the actual tree comes from one scandir walk. Reported differences:
+    - games, characters and poses listed but missing on disk, or on disk but
+      not listed
+    - pose directories without canvas.json, or whose canvas.json names a
+      different game, character or pose
+    - extras listed in canvas.json without a folder, extra folders not
+      listed, and poses missing their faces or blush folder
+
+Usage:
+    python reconcileTree.py [directory] [--write-gamelist]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from spriteTree import CANVAS_FILENAME, GAMELIST_FILENAME, load_json, write_json
+
+POSE_PATTERN = re.compile(r"^pose(\d+)$")
+REQUIRED_FOLDERS = ["faces", "blush"]
+# Left behind by running the tools, never part of the data
+IGNORED_DIRS = {"__pycache__"}
+
+
+def _is_data_dir(entry: os.DirEntry) -> bool:
+    return entry.is_dir() and not entry.name.startswith(".") and entry.name not in IGNORED_DIRS
+
+
+def _subdirs(path: str) -> List[os.DirEntry]:
+    return sorted((entry for entry in os.scandir(path) if _is_data_dir(entry)), key=lambda entry: entry.name)
+
+
+def scan_tree(root: str = ".") -> Dict:
+    """
+    Walk the tree once.
+
+    Only directories that hold pose<N> directories count as characters, and
+    only directories that hold characters count as games.
+
+    Args:
+        root (str): Root of the data tree
+
+    Returns:
+        Dict: {game: {character: {"poses": {pose: {"canvas": Dict or None,
+               "folders": [names]}}, "other": [non-pose dirs]}}}
+    """
+    tree = {}
+    for game in _subdirs(root):
+        characters = {}
+        for character in _subdirs(game.path):
+            entry = {"poses": {}, "other": []}
+            for pose_dir in _subdirs(character.path):
+                match = POSE_PATTERN.match(pose_dir.name)
+                if not match:
+                    entry["other"].append(pose_dir.name)
+                    continue
+                canvas = None
+                folders = []
+                for item in os.scandir(pose_dir.path):
+                    if _is_data_dir(item):
+                        folders.append(item.name)
+                    elif item.name == CANVAS_FILENAME:
+                        canvas = load_json(item.path)
+                entry["poses"][int(match.group(1))] = {"canvas": canvas, "folders": sorted(folders)}
+            if entry["poses"]:
+                characters[character.name] = entry
+        if characters:
+            tree[game.name] = characters
+    return tree
+
+
+def reconcile(gamelist: Dict, tree: Dict) -> List[Tuple[str, str]]:
+    """
+    Compare the expected tree (gamelist.json and canvas.json) to the scanned one.
+
+    Args:
+        gamelist (Dict): Contents of gamelist.json
+        tree (Dict): Result of scan_tree
+
+    Returns:
+        List[Tuple[str, str]]: (path, problem) pairs
+    """
+    problems = []
+
+    for game in sorted(set(gamelist) | set(tree)):
+        if game not in tree:
+            problems.append((game, "listed in gamelist.json but missing on disk"))
+            continue
+        if game not in gamelist:
+            problems.append((game, "game directory not listed in gamelist.json"))
+        listed_characters = gamelist.get(game, {}).get("characters", {})
+
+        for character in sorted(set(listed_characters) | set(tree[game])):
+            character_path = f"{game}/{character}"
+            if character not in tree[game]:
+                problems.append((character_path, "listed in gamelist.json but missing on disk"))
+                continue
+            scanned = tree[game][character]
+            if game in gamelist and character not in listed_characters:
+                problems.append((character_path, "character directory not listed in gamelist.json"))
+            for name in scanned["other"]:
+                problems.append((f"{character_path}/{name}", "unexpected directory (not pose<N>)"))
+
+            listed_poses = set(listed_characters.get(character, {}).get("poses", []))
+            for pose in sorted(listed_poses | set(scanned["poses"])):
+                pose_path = f"{character_path}/pose{pose}"
+                if pose not in scanned["poses"]:
+                    problems.append((pose_path, "listed in gamelist.json but missing on disk"))
+                    continue
+                if character in listed_characters and pose not in listed_poses:
+                    problems.append((pose_path, "pose directory not listed in gamelist.json"))
+                problems.extend((pose_path, problem) for problem in
+                                check_pose(game, character, pose, scanned["poses"][pose]))
+    return problems
+
+
+def check_pose(game: str, character: str, pose: int, scanned: Dict) -> List[str]:
+    """Problems of one scanned pose directory: its canvas.json and folders."""
+    canvas = scanned["canvas"]
+    if canvas is None:
+        return [f"no {CANVAS_FILENAME}"]
+
+    problems = []
+    for field, expected in (("game", game), ("character", character), ("pose", pose)):
+        if canvas.get(field) != expected:
+            problems.append(f"{CANVAS_FILENAME} has {field} {canvas.get(field)!r}, expected {expected!r}")
+
+    extras = canvas.get("extras", [])
+    folders = set(scanned["folders"])
+    for folder in REQUIRED_FOLDERS:
+        if folder not in folders:
+            problems.append(f"no {folder} folder")
+    for extra in extras:
+        if extra not in folders:
+            problems.append(f"extra '{extra}' listed in {CANVAS_FILENAME} but has no folder")
+    for folder in sorted(folders - set(extras) - set(REQUIRED_FOLDERS)):
+        problems.append(f"folder '{folder}' not listed in {CANVAS_FILENAME} extras")
+    return problems
+
+
+def build_gamelist(gamelist: Dict, tree: Dict) -> Dict:
+    """
+    gamelist.json regenerated from the tree.
+
+    Titles and the order of known games and characters are kept; new games
+    and characters are appended (a new game's title is its directory name).
+    """
+    result = {}
+    games = [game for game in gamelist if game in tree] + sorted(set(tree) - set(gamelist))
+    for game in games:
+        listed = gamelist.get(game, {})
+        listed_characters = listed.get("characters", {})
+        characters = ([character for character in listed_characters if character in tree[game]]
+                      + sorted(set(tree[game]) - set(listed_characters)))
+        result[game] = dict(listed, title=listed.get("title", game), characters={
+            character: dict(listed_characters.get(character, {}),
+                            poses=sorted(tree[game][character]["poses"]))
+            for character in characters
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check gamelist.json and canvas.json against the directory tree.")
+    parser.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+    parser.add_argument("--write-gamelist", action="store_true", help="Regenerate gamelist.json from the tree")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    gamelist_path = Path(args.directory) / GAMELIST_FILENAME
+    try:
+        gamelist = load_json(gamelist_path)
+    except FileNotFoundError:
+        print(f"Warning: {gamelist_path} not found, treating it as empty")
+        gamelist = {}
+    tree = scan_tree(args.directory)
+    problems = reconcile(gamelist, tree)
+    elapsed = time.perf_counter() - start
+
+    for path, problem in problems:
+        print(f"  - {path}: {problem}")
+    pose_count = sum(len(character["poses"]) for characters in tree.values() for character in characters.values())
+    print(f"Checked {pose_count} pose(s) in {elapsed * 1000:.1f} ms, {len(problems)} problem(s)")
+
+    if args.write_gamelist:
+        regenerated = build_gamelist(gamelist, tree)
+        if regenerated == gamelist:
+            print(f"{gamelist_path} is already up to date")
+        else:
+            write_json(gamelist_path, regenerated, indent=4, encoding="utf-8")
+            print(f"Wrote {gamelist_path}")
+
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
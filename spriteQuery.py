@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Sprite Query
+Answers questions about the tree from precomputed inverted indexes instead
+of grepping the layer JSON files.
+
+Every layer is indexed under the terms
+    game:<game>  character:<name>  pose:<n>  kind:<body|faces|blush|...>
+    outfit:<outfit>  expression:<expression>  extra:<extras of its pose>
+and queries combine terms with AND (or just a space), OR, NOT and
+parentheses. Values may use shell wildcards (outfit:wCasual*).
+
+Examples:
+    python spriteQuery.py outfit:wCasualCoat_b --values game character pose
+    python spriteQuery.py character:korona pose:2 kind:faces --values expression
+    python spriteQuery.py extra:hairclip --values character
+    python spriteQuery.py "kind:body AND NOT (outfit:nude* OR outfit:underwear*)" --json
+
+The index is cached in .cache/index.pickle and rebuilt automatically when
+any layer or canvas JSON file changed.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import fnmatch
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from spriteTree import CANVAS_FILENAME, atomic_write, find_pose_dirs, iter_layers, load_json
+
+CACHE_PATH = Path(".cache") / "index.pickle"
+INDEX_VERSION = 1
+FIELDS = ["game", "character", "pose", "kind", "outfit", "expression", "extra"]
+
+
+class QueryError(Exception):
+    pass
+
+
+def tree_signature(root=".") -> str:
+    """
+    Fingerprint of every JSON file under the pose directories (path, size,
+    mtime), used to tell whether the cached index is still valid.
+    """
+    digest = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.lower().endswith(".json"):
+                stat = os.stat(os.path.join(dirpath, name))
+                digest.update(f"{dirpath}/{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def build_index(root=".") -> Dict:
+    """
+    Build the layer table and inverted indexes of the tree.
+
+    Args:
+        root: Root of the data tree
+
+    Returns:
+        Dict: {"layers": [layer record, ...],
+               "postings": {field: {value: set of layer numbers}}}
+    """
+    layers = []
+    postings = {field: {} for field in FIELDS}
+
+    for pose_dir in find_pose_dirs(root):
+        extras = load_json(pose_dir / CANVAS_FILENAME).get("extras", [])
+        for layer in iter_layers(pose_dir):
+            record = {
+                "path": Path(os.path.relpath(layer.json_path, root)).as_posix(),
+                "game": layer.game,
+                "character": layer.character,
+                "pose": str(layer.pose),
+                "kind": layer.kind,
+                "outfit": layer.data.get("outfit"),
+                "expression": layer.data.get("expression"),
+                "extra": list(extras),
+            }
+            number = len(layers)
+            layers.append(record)
+            for field in FIELDS:
+                values = record[field] if isinstance(record[field], list) else [record[field]]
+                for value in values:
+                    if value is not None:
+                        postings[field].setdefault(str(value), set()).add(number)
+
+    return {"layers": layers, "postings": postings}
+
+
+def load_index(root=".", rebuild: bool = False) -> Dict:
+    """
+    Load the cached index, rebuilding it if the tree changed.
+
+    Args:
+        root: Root of the data tree
+        rebuild (bool): Ignore the cache
+
+    Returns:
+        Dict: Index as returned by build_index
+    """
+    cache_path = Path(root) / CACHE_PATH
+    signature = tree_signature(root)
+    if not rebuild:
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("version") == INDEX_VERSION and cached.get("signature") == signature:
+                return cached["index"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+
+    index = build_index(root)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(cache_path) as f:
+        pickle.dump({"version": INDEX_VERSION, "signature": signature, "index": index}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    return index
+
+
+# A token is "(", ")" or a run of characters where quoted parts may hold
+# spaces and parentheses: expression:"038 (a only)"
+TOKEN_PATTERN = re.compile(r'\s*(?:\(|\)|(?:[^\s()"]|"[^"]*")+)')
+
+
+def tokenize(query: str) -> List[str]:
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = TOKEN_PATTERN.match(query, position)
+        if not match:
+            raise QueryError(f"Cannot parse query at: {query[position:]}")
+        tokens.append(match.group(0).strip())
+        position = match.end()
+    return tokens
+
+
+class QueryParser:
+    """
+    Recursive-descent evaluator for the query language:
+        expr   := and_expr (OR and_expr)*
+        and_expr := unary ([AND] unary)*
+        unary  := NOT unary | "(" expr ")" | field:value
+    """
+
+    def __init__(self, index: Dict, tokens: List[str]):
+        self.postings = index["postings"]
+        self.universe = set(range(len(index["layers"])))
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> str:
+        return self.tokens[self.position] if self.position < len(self.tokens) else ""
+
+    def take(self) -> str:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self) -> Set[int]:
+        result = self.expr()
+        if self.position != len(self.tokens):
+            raise QueryError(f"Unexpected '{self.peek()}'")
+        return result
+
+    def expr(self) -> Set[int]:
+        result = self.and_expr()
+        while self.peek().upper() == "OR":
+            self.take()
+            result = result | self.and_expr()
+        return result
+
+    def and_expr(self) -> Set[int]:
+        result = self.unary()
+        while self.peek() and self.peek() != ")" and self.peek().upper() != "OR":
+            if self.peek().upper() == "AND":
+                self.take()
+            result = result & self.unary()
+        return result
+
+    def unary(self) -> Set[int]:
+        token = self.take()
+        if not token:
+            raise QueryError("Query ended unexpectedly")
+        if token.upper() == "NOT":
+            return self.universe - self.unary()
+        if token == "(":
+            result = self.expr()
+            if self.take() != ")":
+                raise QueryError("Missing ')'")
+            return result
+        return self.term(token)
+
+    def term(self, token: str) -> Set[int]:
+        field, _, value = token.partition(":")
+        if field not in self.postings or not value:
+            raise QueryError(f"Expected field:value with field in {', '.join(FIELDS)}, got '{token}'")
+        value = value.replace('"', "")
+        values = self.postings[field]
+        if any(c in value for c in "*?["):
+            matched = set()
+            for candidate in fnmatch.filter(values, value):
+                matched |= values[candidate]
+            return matched
+        return set(values.get(value, ()))
+
+
+def run_query(index: Dict, query: str) -> List[Dict]:
+    """
+    Evaluate a query against an index.
+
+    Args:
+        index (Dict): Index from load_index
+        query (str): Query string
+
+    Returns:
+        List[Dict]: Matching layer records in tree order
+    """
+    numbers = QueryParser(index, tokenize(query)).parse()
+    return [index["layers"][n] for n in sorted(numbers)]
+
+
+def distinct_values(records: List[Dict], fields: List[str]) -> List[Tuple]:
+    """Distinct combinations of the given fields among records, sorted."""
+    values = set()
+    for record in records:
+        row = []
+        for field in fields:
+            value = record.get(field)
+            row.append(", ".join(value) if isinstance(value, list) else value)
+        values.add(tuple(row))
+    return sorted(values, key=lambda row: [str(v) for v in row])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query layers by outfit, expression, character, pose and extras.")
+    parser.add_argument("query", nargs="+", help="Query terms, e.g. character:korona pose:2 kind:faces")
+    parser.add_argument("--root", default=".", help="Root of the data tree (default: current)")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--json", action="store_true", help="Print matching layer records as JSON")
+    output.add_argument("--values", nargs="+", choices=FIELDS, help="Print distinct values of these fields")
+    output.add_argument("--count", action="store_true", help="Print the number of matching layers")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index cache")
+    parser.add_argument("--time", action="store_true", help="Report index load and query times")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = load_index(args.root, rebuild=args.rebuild)
+    loaded = time.perf_counter()
+    try:
+        records = run_query(index, " ".join(args.query))
+    except QueryError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    queried = time.perf_counter()
+
+    if args.json:
+        print(json.dumps(records, indent=2, ensure_ascii=False))
+    elif args.values:
+        for row in distinct_values(records, args.values):
+            print("\t".join("" if v is None else str(v) for v in row))
+    elif args.count:
+        print(len(records))
+    else:
+        for record in records:
+            print(record["path"])
+
+    if args.time:
+        print(f"index: {(loaded - start) * 1000:.1f} ms, query: {(queried - loaded) * 1000:.3f} ms, "
+              f"{len(records)} match(es)", file=sys.stderr)
+
+    # Exit with an error code if nothing matched, like grep
+    if not records:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
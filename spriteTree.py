@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Sprite Tree Helpers
+Shared helpers for the tools at the top of the data tree: walking the
+game/character/pose layout and reading and writing the layer JSON files.
+
+Layout:
+    <game>/<character>/pose<N>/canvas.json          pose canvas size and extras
+    <game>/<character>/pose<N>/<name>.json/.png     body layers ("outfit")
+    <game>/<character>/pose<N>/<folder>/<name>.*    faces, blush and extras
+                                                    ("expression")
+"""
+
+import io
+import os
+import re
+import codecs
+import json
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg"]
+CANVAS_FILENAME = "canvas.json"
+GAMELIST_FILENAME = "gamelist.json"
+OUTFIT_PATTERN = re.compile(r"^(?P<base>.*?)(?:_(?P<variant>[a-z]))?$")
+# Expressions limited to one outfit variant look like "018 (a only)"
+EXPRESSION_PATTERN = re.compile(r"^(?P<id>\S+)(?:\s+\((?P<variant>[a-z]) only\))?$")
+
+
+class Layer(NamedTuple):
+    """A single layer: its JSON metadata and the image next to it."""
+    game: str
+    character: str
+    pose: int
+    kind: str                   # "body", "faces", "blush" or an extras folder
+    json_path: Path
+    image_path: Optional[Path]
+    data: Dict
+
+
+def load_json(path) -> Dict:
+    """
+    Load a JSON file, accepting an optional UTF-8 BOM.
+
+    Args:
+        path: Path to the JSON file
+
+    Returns:
+        Dict: The parsed JSON data
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+@contextmanager
+def atomic_write(path) -> Iterator[BinaryIO]:
+    """
+    Open a binary file that atomically replaces path when the block ends.
+
+    Data goes to a uniquely named ".tmp_" file in the same directory, which
+    is moved over path on success and removed on failure, so readers never
+    see a half-written file and concurrent writers never share one.
+
+    Args:
+        path: Path of the file to write
+
+    Yields:
+        BinaryIO: The temporary file, open for writing
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=os.path.splitext(path)[1], dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_text(path, text: str, encoding: str, newline: Optional[str] = None) -> None:
+    with atomic_write(path) as f, io.TextIOWrapper(f, encoding=encoding, newline=newline) as text_file:
+        text_file.write(text)
+
+
+def write_json(path, data: Dict, indent: int = 2, encoding: str = "utf-8-sig") -> None:
+    """
+    Atomically write a layer JSON file in the same format as outfitEditor.
+
+    The data is written to a temporary file in the same directory and then
+    moved over the target, so readers never see a half-written file.
+
+    Args:
+        path: Path to the JSON file
+        data (Dict): Data to write
+        indent (int): Indentation (gamelist.json uses 4)
+        encoding (str): File encoding (gamelist.json has no BOM: "utf-8")
+    """
+    _write_text(path, json.dumps(data, indent=indent, ensure_ascii=False), encoding)
+
+
+def update_json_numbers(path, values: Dict[str, int]) -> None:
+    """
+    Atomically change integer values of a JSON file, keeping its layout.
+
+    Only the numbers after the given keys are substituted, so indentation,
+    key spacing, the BOM and line endings stay as they were.
+
+    Args:
+        path: Path to the JSON file
+        values (Dict[str, int]): New value of each key
+
+    Raises:
+        KeyError: If a key has no integer value in the file
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    encoding = "utf-8-sig" if raw.startswith(codecs.BOM_UTF8) else "utf-8"
+    text = raw.decode(encoding)
+    for key, value in values.items():
+        pattern = re.compile(r'("' + re.escape(key) + r'"\s*:\s*)-?\d+')
+        text, count = pattern.subn(lambda match: match.group(1) + str(int(value)), text, count=1)
+        if not count:
+            raise KeyError(f"{key} not found in {path}")
+    _write_text(path, text, encoding, newline="")
+
+
+def split_outfit(outfit: str) -> Tuple[str, Optional[str]]:
+    """
+    Split an outfit tag into base name and variant letter.
+
+    Args:
+        outfit (str): Outfit tag, e.g. "wUniCoat_a"
+
+    Returns:
+        Tuple[str, Optional[str]]: ("wUniCoat", "a"), or (outfit, None)
+    """
+    match = OUTFIT_PATTERN.match(outfit)
+    return match.group("base"), match.group("variant")
+
+
+def split_expression(expression: str) -> Tuple[str, Optional[str]]:
+    """
+    Split an expression into its ID and the outfit variant it is limited to.
+
+    Args:
+        expression (str): Expression value, e.g. "018 (a only)"
+
+    Returns:
+        Tuple[str, Optional[str]]: ("018", "a"), or (expression, None)
+    """
+    match = EXPRESSION_PATTERN.match(expression.strip())
+    if not match:
+        return expression, None
+    return match.group("id"), match.group("variant")
+
+
+def find_image(json_path) -> Optional[Path]:
+    """
+    Find the image that belongs to a layer JSON file (same basename).
+
+    Args:
+        json_path: Path to the layer JSON file
+
+    Returns:
+        Optional[Path]: Path to the image, or None if there is none
+    """
+    json_path = Path(json_path)
+    for ext in IMAGE_EXTENSIONS:
+        candidate = json_path.with_suffix(ext)
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def find_pose_dirs(root=".") -> List[Path]:
+    """
+    Recursively find all pose directories (directories holding a canvas.json).
+
+    Args:
+        root: Directory to search
+
+    Returns:
+        List[Path]: Sorted list of pose directories
+    """
+    pose_dirs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        if CANVAS_FILENAME in filenames:
+            pose_dirs.append(Path(dirpath))
+    return pose_dirs
+
+
+def iter_layers(pose_dir, kinds: Optional[List[str]] = None) -> Iterator[Layer]:
+    """
+    Yield the layers of one pose directory.
+
+    Body layers are the JSON files directly inside the pose directory; every
+    subdirectory (faces, blush, extras) is a layer kind named after the folder.
+
+    Args:
+        pose_dir: Pose directory containing canvas.json
+        kinds (Optional[List[str]]): Only yield these kinds (default: all)
+
+    Returns:
+        Iterator[Layer]: Layers sorted by kind and filename
+    """
+    pose_dir = Path(pose_dir)
+    canvas = load_json(pose_dir / CANVAS_FILENAME)
+    game, character, pose = canvas["game"], canvas["character"], canvas["pose"]
+
+    folders = [("body", pose_dir)]
+    for entry in sorted(os.scandir(pose_dir), key=lambda e: e.name):
+        if entry.is_dir() and not entry.name.startswith("."):
+            folders.append((entry.name, Path(entry.path)))
+
+    for kind, folder in folders:
+        if kinds is not None and kind not in kinds:
+            continue
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            name = entry.name
+            if not entry.is_file() or not name.lower().endswith(".json") or name == CANVAS_FILENAME:
+                continue
+            json_path = Path(entry.path)
+            yield Layer(game, character, pose, kind, json_path, find_image(json_path), load_json(json_path))
+
+
+def iter_all_layers(root=".", kinds: Optional[List[str]] = None) -> Iterator[Layer]:
+    """
+    Yield the layers of every pose under root.
+
+    Args:
+        root: Directory to search
+        kinds (Optional[List[str]]): Only yield these kinds (default: all)
+
+    Returns:
+        Iterator[Layer]: Layers of all poses
+    """
+    for pose_dir in find_pose_dirs(root):
+        yield from iter_layers(pose_dir, kinds)
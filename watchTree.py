@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Tree Watcher
+Long-running watch mode for the data tree. Instead of rescanning the whole
+tree like jsonCheck.py or unpremultiply.py, it waits for .json/.png changes,
+debounces them and re-runs the per-file work for just the changed files:
+
+    validate        check that changed JSON files parse
+    previews        rebuild the preview pyramid of changed images (buildPreviews)
+    tiles           refresh existing tile files of changed images (layerTiles)
+    unpremultiply   write unpr_ copies of changed images detected as
+                    premultiplied (unpremultiply.py)
+
+Change events come from inotify on Linux; elsewhere, or with --poll, the
+tree is polled for modification times instead. If the inotify queue
+overflows, the tree is rescanned and compared with the last known sizes and
+modification times, so no change is lost.
+
+Usage:
+    python watchTree.py [directory] [--actions validate previews ...] [--poll]
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import argparse
+import importlib.util
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import buildPreviews
+import layerTiles
+from spriteTree import load_json
+
+WATCHED_EXTENSIONS = (".json", ".png")
+DEFAULT_ACTIONS = ["validate", "previews"]
+ALL_ACTIONS = ["validate", "previews", "tiles", "unpremultiply"]
+DEFAULT_DEBOUNCE = 0.25
+DEFAULT_POLL_INTERVAL = 1.0
+UNPREMULTIPLY_SCRIPT = Path(__file__).parent / "miazora" / "korona" / "pose2" / "faces" / "unpremultiply.py"
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_watched(path: str) -> bool:
+    """Whether a changed path is a tree file worth reacting to."""
+    name = os.path.basename(path)
+    if name.startswith(".") or name.startswith("unpr_"):
+        return False
+    parts = Path(path).parts
+    if any(part.startswith(".") and part not in (".", "..") for part in parts[:-1]):
+        return False
+    return name.lower().endswith(WATCHED_EXTENSIONS)
+
+
+def _watched_dirs(root: str) -> List[str]:
+    dirs = []
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        dirs.append(dirpath)
+    return dirs
+
+
+def snapshot_files(root: str) -> Dict[str, Tuple[int, int]]:
+    """(size, mtime_ns) of every watched-extension file in the watched directories."""
+    snapshot = {}
+    for directory in _watched_dirs(root):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.lower().endswith(WATCHED_EXTENSIONS):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def diff_snapshots(old: Dict[str, Tuple[int, int]], new: Dict[str, Tuple[int, int]]) -> List[str]:
+    """Paths added, changed or removed between two snapshots."""
+    changed = [path for path, signature in new.items() if old.get(path) != signature]
+    changed.extend(path for path in old if path not in new)
+    return changed
+
+
+class InotifyWatcher:
+    """Recursive watcher on top of Linux inotify."""
+
+    def __init__(self, root: str):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.dirs = {}
+        for directory in _watched_dirs(root):
+            self.add_dir(directory)
+        # Known file states, to find what changed if the event queue overflows
+        self.snapshot = snapshot_files(root)
+
+    def add_dir(self, directory: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify watch limit reached")
+            return
+        self.dirs[wd] = directory
+
+    def changes(self, timeout: Optional[float]) -> List[str]:
+        """
+        Wait up to timeout seconds (forever if None) for changed paths.
+
+        Returns:
+            List[str]: Changed file paths, possibly empty
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        overflow = False
+        position = 0
+        while position < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, position)
+            position += EVENT_HEADER.size
+            name = os.fsdecode(buffer[position:position + length].rstrip(b"\0"))
+            position += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Sent with wd -1: events were dropped
+                overflow = True
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                self.dirs.pop(wd, None)
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                # New folders (e.g. a new pose) are watched too, and files
+                # already in them count as changed
+                if mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith("."):
+                    for new_dir in _watched_dirs(path):
+                        self.add_dir(new_dir)
+                        changed.extend(entry.path for entry in os.scandir(new_dir) if entry.is_file())
+                continue
+            changed.append(path)
+
+        if overflow:
+            print("Warning: inotify event queue overflowed, rescanning the tree")
+            return self.rescan()
+        for path in changed:
+            if path.lower().endswith(WATCHED_EXTENSIONS):
+                try:
+                    stat = os.stat(path)
+                    self.snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+                except FileNotFoundError:
+                    self.snapshot.pop(path, None)
+        return changed
+
+    def rescan(self) -> List[str]:
+        """
+        Watch any directory missed and find changes by comparing a new scan
+        with the snapshot, after inotify dropped events.
+
+        Returns:
+            List[str]: Paths changed since the snapshot
+        """
+        for directory in _watched_dirs(self.root):
+            self.add_dir(directory)
+        current = snapshot_files(self.root)
+        changed = diff_snapshots(self.snapshot, current)
+        self.snapshot = current
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback watcher comparing file modification times between scans."""
+
+    def __init__(self, root: str, interval: float = DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.snapshot = snapshot_files(root)
+
+    def changes(self, timeout: Optional[float]) -> List[str]:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        current = snapshot_files(self.root)
+        changed = diff_snapshots(self.snapshot, current)
+        self.snapshot = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def watch(root: str, handler: Callable[[List[str]], None], debounce: float = DEFAULT_DEBOUNCE,
+          poll: bool = False, poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+    """
+    Watch root and call handler with batches of changed files.
+
+    A batch is handed over once no new change arrived for debounce seconds,
+    so a tool saving many files at once triggers a single run.
+
+    Args:
+        root (str): Directory to watch
+        handler (Callable[[List[str]], None]): Called with sorted changed paths
+        debounce (float): Quiet time in seconds before a batch is handled
+        poll (bool): Use the polling watcher even if inotify is available
+        poll_interval (float): Seconds between scans of the polling watcher
+    """
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher(root)
+            print(f"Watching {os.path.abspath(root)} with inotify ({len(watcher.dirs)} directories)")
+        except OSError as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    if watcher is None:
+        watcher = PollingWatcher(root, poll_interval)
+        print(f"Watching {os.path.abspath(root)} by polling every {poll_interval}s")
+
+    pending = {}
+    try:
+        while True:
+            timeout = debounce if pending else None
+            changed = watcher.changes(timeout)
+            # Stamp after the wait, or changes after an idle spell look stale
+            now = time.monotonic()
+            for path in changed:
+                if is_watched(path):
+                    pending[path] = now
+            if pending and time.monotonic() - max(pending.values()) >= debounce:
+                batch = sorted(pending)
+                pending.clear()
+                handler(batch)
+    finally:
+        watcher.close()
+
+
+def _load_unpremultiply():
+    """Load unpremultiply.py, which lives with the korona faces it was written for."""
+    spec = importlib.util.spec_from_file_location("unpremultiply", UNPREMULTIPLY_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def validate_json_file(path: str) -> Tuple[bool, str]:
+    """
+    Check that a JSON file parses (same result as jsonCheck.py for tree files).
+
+    Args:
+        path (str): Path to the JSON file
+
+    Returns:
+        Tuple[bool, str]: (is_valid, error_message)
+    """
+    try:
+        load_json(path)
+        return True, ""
+    except UnicodeDecodeError as e:
+        return False, f"Could not decode file: {e}"
+    except ValueError as e:
+        return False, f"JSON decode error: {e}"
+    except OSError as e:
+        return False, str(e)
+
+
+def make_handler(root: str, actions: List[str]) -> Callable[[List[str]], None]:
+    """
+    Build the batch handler running the selected actions on changed files.
+
+    Args:
+        root (str): Root of the data tree
+        actions (List[str]): Actions to run (see module docstring)
+
+    Returns:
+        Callable[[List[str]], None]: Handler for watch()
+    """
+    unpremultiply = _load_unpremultiply() if "unpremultiply" in actions else None
+
+    def handle(paths: List[str]) -> None:
+        start = time.perf_counter()
+        existing = [path for path in paths if os.path.exists(path)]
+        json_files = [path for path in existing if path.lower().endswith(".json")]
+        images = [path for path in paths if path.lower().endswith(".png")]
+        problems = []
+
+        if "validate" in actions:
+            for path in json_files:
+                is_valid, error = validate_json_file(path)
+                if not is_valid:
+                    problems.append(f"✗ INVALID: {path}: {error}")
+
+        if "previews" in actions and images:
+            for path, error in buildPreviews.update_previews(images, root):
+                problems.append(f"✗ PREVIEW: {path}: {error}")
+
+        if "tiles" in actions:
+            for path in images:
+                # Only refresh tile files someone already asked for
+                if os.path.exists(path) and layerTiles.tile_path(path, root).exists():
+                    try:
+                        layerTiles.convert_layer(path, root)
+                    except Exception as e:
+                        problems.append(f"✗ TILES: {path}: {e}")
+
+        if unpremultiply is not None:
+            for path in images:
+                if not os.path.exists(path):
+                    continue
+                try:
+                    with unpremultiply.Image.open(path) as img:
+                        is_premultiplied, confidence = unpremultiply.detect_premultiplied(img)
+                except Exception as e:
+                    problems.append(f"✗ UNPREMULTIPLY: {path}: {e}")
+                    continue
+                if is_premultiplied and confidence >= unpremultiply.DEFAULT_MIN_CONFIDENCE:
+                    output_path = os.path.join(os.path.dirname(path), "unpr_" + os.path.basename(path))
+                    unpremultiply.unpremultiply_image(path, output_path)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[{time.strftime('%H:%M:%S')}] {len(paths)} change(s) handled in {elapsed:.0f} ms")
+        for path in paths:
+            print(f"    {'changed' if path in existing else 'deleted'}: {path}")
+        for problem in problems:
+            print(f"  {problem}")
+
+    return handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch the data tree and re-run per-file checks on change.")
+    parser.add_argument("directory", nargs="?", default=".", help="Directory to watch (default: current)")
+    parser.add_argument("--actions", nargs="+", choices=ALL_ACTIONS, default=DEFAULT_ACTIONS,
+                        help=f"Work to run on changed files (default: {' '.join(DEFAULT_ACTIONS)})")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help=f"Seconds of quiet before handling a batch (default: {DEFAULT_DEBOUNCE})")
+    parser.add_argument("--poll", action="store_true", help="Poll instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"Seconds between scans when polling (default: {DEFAULT_POLL_INTERVAL})")
+    args = parser.parse_args()
+
+    try:
+        watch(args.directory, make_handler(args.directory, args.actions),
+              debounce=args.debounce, poll=args.poll, poll_interval=args.poll_interval)
+    except KeyboardInterrupt:
+        print("\nStopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Web Export
+Converts every layer (and, with --merged, the pre-merged face+blush layers of
+mergeBlush) into the smallest web format that stays within an error budget.
+
+Each image is encoded as
+    webp-lossless   lossless WebP
+    webp            lossy WebP (alpha kept lossless)
+    png8            palette-quantized PNG
+    avif            lossy AVIF (only if Pillow was built with AVIF support)
+decoded again and compared to the source. Errors are measured as RMS over
+premultiplied RGBA in 0-255 units over the visible pixels, so colors under
+fully transparent pixels do not count. The smallest candidate within --max-error is written;
+lossless WebP always qualifies, so every image gets an output.
+
+Outputs mirror the tree under .cache/web, next to manifest.json which lists
+the chosen format, byte size, error and encode time of every candidate.
+Images whose source and --max-error/--quality did not change since the last run
+are skipped.
+
+Usage:
+    python webExport.py [directory] [--max-error E] [--quality Q]
+                        [--formats webp png8 ...] [--merged] [--force]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, features
+
+from spriteTree import atomic_write, iter_all_layers, load_json, write_json
+
+CACHE_DIR = Path(".cache") / "web"
+MERGED_DIR = Path(".cache") / "merged"
+MANIFEST_FILENAME = "manifest.json"
+DEFAULT_MAX_ERROR = 3.0
+DEFAULT_QUALITY = 90
+
+# Format name -> file extension
+FORMATS = {
+    "webp-lossless": ".webp",
+    "webp": ".webp",
+    "png8": ".png",
+}
+if features.check("avif"):
+    FORMATS["avif"] = ".avif"
+
+
+def encode(img: Image.Image, fmt: str, quality: int = DEFAULT_QUALITY) -> bytes:
+    """
+    Encode an RGBA image in one of FORMATS.
+
+    Args:
+        img (Image.Image): RGBA source image
+        fmt (str): Format name
+        quality (int): Quality of the lossy formats (0-100)
+
+    Returns:
+        bytes: Encoded file
+    """
+    buffer = io.BytesIO()
+    if fmt == "webp-lossless":
+        img.save(buffer, "WEBP", lossless=True, method=4)
+    elif fmt == "webp":
+        img.save(buffer, "WEBP", quality=quality, alpha_quality=100, method=4)
+    elif fmt == "png8":
+        img.quantize(256, method=Image.Quantize.FASTOCTREE).save(buffer, "PNG", optimize=True)
+    elif fmt == "avif":
+        img.save(buffer, "AVIF", quality=quality, speed=6)
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    return buffer.getvalue()
+
+
+def premultiplied(img: Image.Image) -> np.ndarray:
+    pixels = np.asarray(img.convert("RGBA"), dtype=np.float32)
+    pixels[..., :3] *= pixels[..., 3:] / 255
+    return pixels
+
+
+def rms_error(source: np.ndarray, encoded: bytes) -> float:
+    """
+    RMS difference between premultiplied source pixels and a decoded file,
+    over the pixels that are visible in either of them.
+    """
+    with Image.open(io.BytesIO(encoded)) as img:
+        decoded = premultiplied(img)
+    visible = (source[..., 3] > 0) | (decoded[..., 3] > 0)
+    if not visible.any():
+        return 0.0
+    return float(np.sqrt(np.mean(np.square(decoded[visible] - source[visible]))))
+
+
+def export_image(image_path: str, target_stem: str, formats: List[str], max_error: float,
+                 quality: int = DEFAULT_QUALITY) -> Dict:
+    """
+    Encode one image in every format and write the smallest acceptable one.
+
+    Args:
+        image_path (str): Source image
+        target_stem (str): Output path without extension
+        formats (List[str]): Candidate formats
+        max_error (float): Largest acceptable RMS error
+        quality (int): Quality of the lossy formats
+
+    Returns:
+        Dict: Manifest entry
+    """
+    stat = os.stat(image_path)
+    with Image.open(image_path) as img:
+        source = img.convert("RGBA")
+    source_pixels = premultiplied(source)
+
+    candidates = {}
+    best = None
+    for fmt in formats:
+        start = time.perf_counter()
+        data = encode(source, fmt, quality)
+        encode_ms = (time.perf_counter() - start) * 1000
+        error = 0.0 if fmt == "webp-lossless" else rms_error(source_pixels, data)
+        candidates[fmt] = {"bytes": len(data), "error": round(error, 3), "encode_ms": round(encode_ms, 1)}
+        if error <= max_error and (best is None or len(data) < len(best[1])):
+            best = (fmt, data)
+
+    if best is None:
+        fmt = "webp-lossless"
+        best = (fmt, encode(source, fmt))
+
+    fmt, data = best
+    target = Path(target_stem + FORMATS[fmt])
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(target) as f:
+        f.write(data)
+
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "max_error": max_error,
+        "quality": quality,
+        "format": fmt,
+        "file": target.name,
+        "bytes": len(data),
+        "candidates": candidates,
+    }
+
+
+def _export_job(args: Tuple[str, str, str, List[str], float, int]) -> Tuple[str, Optional[Dict], str]:
+    key, image_path, target_stem, formats, max_error, quality = args
+    try:
+        return key, export_image(image_path, target_stem, formats, max_error, quality), ""
+    except Exception as e:
+        return key, None, str(e)
+
+
+def find_sources(directory: str = ".", merged: bool = False) -> List[Tuple[str, str]]:
+    """
+    (key, image path) of every image to export; keys are paths relative to
+    directory, merged layers keep their .cache/merged prefix.
+    """
+    sources = []
+    for layer in iter_all_layers(directory):
+        if layer.image_path is not None:
+            sources.append((Path(os.path.relpath(layer.image_path, directory)).as_posix(), str(layer.image_path)))
+    if merged:
+        for path in sorted((Path(directory) / MERGED_DIR).rglob("*.png")):
+            if not path.name.startswith(".tmp_"):
+                sources.append((Path(os.path.relpath(path, directory)).as_posix(), str(path)))
+    return sources
+
+
+def is_fresh(entry: Optional[Dict], image_path, output: Path, key: str, formats: List[str],
+             max_error: float, quality: int) -> bool:
+    """
+    Whether a manifest entry matches its source and settings and its output
+    file still exists.
+    """
+    if not entry or set(entry["candidates"]) != set(formats):
+        return False
+    if (entry.get("max_error"), entry.get("quality")) != (max_error, quality):
+        return False
+    try:
+        stat = os.stat(image_path)
+    except FileNotFoundError:
+        return False
+    return ((stat.st_size, stat.st_mtime_ns) == (entry["size"], entry["mtime_ns"])
+            and (output / Path(key).parent / entry["file"]).exists())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export layers in the smallest web format within an error budget.")
+    parser.add_argument("directory", nargs="?", default=".", help="Root of the data tree (default: current)")
+    parser.add_argument("-o", "--output", help=f"Output directory (default: <directory>/{CACHE_DIR})")
+    parser.add_argument("--max-error", type=float, default=DEFAULT_MAX_ERROR,
+                        help=f"Largest RMS error (0-255) of a lossy output (default: {DEFAULT_MAX_ERROR})")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"Quality of lossy WebP/AVIF (default: {DEFAULT_QUALITY})")
+    parser.add_argument("--formats", nargs="+", choices=list(FORMATS), default=list(FORMATS),
+                        help="Candidate formats (default: all available)")
+    parser.add_argument("--merged", action="store_true", help=f"Also export the merged layers in {MERGED_DIR}")
+    parser.add_argument("--force", action="store_true", help="Re-export up-to-date images")
+    args = parser.parse_args()
+
+    output = Path(args.output) if args.output else Path(args.directory) / CACHE_DIR
+    manifest_path = output / MANIFEST_FILENAME
+    manifest = load_json(manifest_path) if manifest_path.exists() else {}
+
+    jobs = []
+    sources = find_sources(args.directory, args.merged)
+    for key, image_path in sources:
+        entry = manifest.get(key)
+        if not args.force and is_fresh(entry, image_path, output, key, args.formats, args.max_error, args.quality):
+            continue
+        target_stem = str(output / Path(key).with_suffix(""))
+        jobs.append((key, image_path, target_stem, args.formats, args.max_error, args.quality))
+
+    errors = []
+    with ProcessPoolExecutor() as executor:
+        for key, entry, error in executor.map(_export_job, jobs):
+            if entry is None:
+                errors.append((key, error))
+                manifest.pop(key, None)
+                continue
+            old = manifest.get(key)
+            if old and old["file"] != entry["file"]:
+                # The chosen format changed; drop the file in the old format
+                stale = output / Path(key).parent / old["file"]
+                if stale.exists():
+                    stale.unlink()
+            manifest[key] = entry
+
+    # Forget images that no longer exist
+    keys = {key for key, _ in sources}
+    for key in set(manifest) - keys:
+        del manifest[key]
+
+    output.mkdir(parents=True, exist_ok=True)
+    write_json(manifest_path, dict(sorted(manifest.items())))
+
+    source_bytes = sum(entry["size"] for entry in manifest.values())
+    export_bytes = sum(entry["bytes"] for entry in manifest.values())
+    chosen = {}
+    for entry in manifest.values():
+        chosen[entry["format"]] = chosen.get(entry["format"], 0) + 1
+    print(f"Exported {len(jobs) - len(errors)} image(s), {len(sources) - len(jobs)} already up to date")
+    if manifest:
+        print(f"Total {export_bytes / 1e6:.1f} MB from {source_bytes / 1e6:.1f} MB of source images "
+              f"({export_bytes / max(1, source_bytes) * 100:.0f}%)")
+        print("Formats: " + ", ".join(f"{fmt} {count}" for fmt, count in sorted(chosen.items())))
+    if errors:
+        print("\nFailed images:")
+        for key, error in errors:
+            print(f"  - {key}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()